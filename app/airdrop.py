@@ -0,0 +1,224 @@
+from database import AIRDROPS_TABLE_NAME, DELIVERIES_TABLE_NAME, adb, db
+from datetime import datetime
+from typing import List
+from tinydb.table import Document
+from outbound import Priority, outbound
+from constants import *
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+CLAIM_URL = 'http://POAP.xyz/claim/'
+THANK_YOU = 'Thank you for your help in advancing Crypto-Goverance research!' \
+    ' As a token of our gratitude, please accept this badge that you can add' \
+    ' to your crypto wallet! {url}'
+
+# A delivery is assigned a code before anything is sent. It is marked as
+# sending right before the direct message goes out and sent or failed after.
+ASSIGNED = 'assigned'
+SENDING  = 'sending'
+SENT     = 'sent'
+FAILED   = 'failed'
+# Was sending when the bot stopped, so it may or may not have arrived.
+UNKNOWN  = 'unknown'
+
+def create_airdrop(channel_id) -> int:
+    """Assigns a code to every curator and records who gets which before
+    anything is sent, so a restart knows exactly what is still owed.
+
+    :param channel_id: Where to report progress.
+    :type channel_id: int
+    :return: The id of the airdrop.
+    :rtype: int
+    """
+    with db.transaction():
+        airdrop_id = db.table(AIRDROPS_TABLE_NAME).insert({
+            'channel_id':  channel_id,
+            'started_at':  datetime.utcnow().isoformat(),
+            'finished_at': None
+        })
+
+        curator_ids = sorted(db.get_curator_ids())
+        deliveries = []
+        for user_id in curator_ids:
+            code = db.pop_compensation_code(user_id)
+            if code is None:
+                break
+
+            deliveries.append({
+                'airdrop': airdrop_id,
+                'user_id': user_id,
+                'code':    code,
+                'state':   ASSIGNED
+            })
+
+        db.table(DELIVERIES_TABLE_NAME).insert_multiple(deliveries)
+        db.table(AIRDROPS_TABLE_NAME).update({
+            'unassigned': len(curator_ids) - len(deliveries)
+        }, doc_ids=[airdrop_id])
+
+    # The codes are claimed before any of them are sent.
+    db.sync()
+    return airdrop_id
+
+def take_deliveries(airdrop_id) -> List[Document]:
+    """Gets every delivery that is yet to be sent. Any that were being sent
+    when the bot stopped are marked unknown rather than being sent twice."""
+    table = db.table(DELIVERIES_TABLE_NAME)
+    interrupted = table.find_ids(airdrop=airdrop_id, state=SENDING)
+    if interrupted:
+        table.update({'state': UNKNOWN}, doc_ids=interrupted)
+    return table.find(airdrop=airdrop_id, state=ASSIGNED)
+
+def start_sending(doc_id):
+    # Must be on disk before the code goes out, see `take_deliveries`.
+    set_state(doc_id, SENDING)
+    db.sync()
+
+def set_state(doc_id, state, error=None):
+    fields = {'state': state, 'updated_at': datetime.utcnow().isoformat()}
+    if error is not None:
+        fields['error'] = error
+    db.table(DELIVERIES_TABLE_NAME).update(fields, doc_ids=[doc_id])
+
+def finish_airdrop(airdrop_id) -> dict:
+    """Marks the airdrop as finished.
+
+    :return: Maps each state onto the ids of the users in it.
+    :rtype: dict
+    """
+    db.table(AIRDROPS_TABLE_NAME).update({
+        'finished_at': datetime.utcnow().isoformat()
+    }, doc_ids=[airdrop_id])
+
+    table = db.table(DELIVERIES_TABLE_NAME)
+    return {state: [d['user_id'] for d in table.find(airdrop=airdrop_id,
+        state=state)] for state in (SENT, FAILED, UNKNOWN)}
+
+def unfinished_airdrops() -> List[Document]:
+    return db.table(AIRDROPS_TABLE_NAME).find(finished_at=None)
+
+def mentions(user_ids, limit=20) -> str:
+    text = ', '.join(f'<@{user_id}>' for user_id in user_ids[:limit])
+    if len(user_ids) > limit:
+        text += f' and {len(user_ids) - limit} more'
+    return text
+
+class Airdrop:
+    """Sends every curator the code that they were assigned in the background,
+    a few direct messages at a time. Progress is kept in the deliveries table,
+    so an airdrop that is interrupted picks up where it left off.
+
+    Example:
+
+        `airdrop = await Airdrop.start(bot, ctx.channel.id)`
+    """
+    def __init__(self, bot, document):
+        self.bot = bot
+        self.id = document.doc_id
+        self.channel_id = document['channel_id']
+        self.unassigned = document.get('unassigned', 0)
+        self.total = 0
+        self.sent = 0
+        self.failed = 0
+        self.task = None
+        self._report = None
+
+    @classmethod
+    async def start(cls, bot, channel_id) -> 'Airdrop':
+        airdrop_id = await adb.write(create_airdrop, channel_id)
+        document = await adb.read(lambda: db.table(AIRDROPS_TABLE_NAME).get(
+            doc_id=airdrop_id))
+        return cls.resume(bot, document)
+
+    @classmethod
+    def resume(cls, bot, document) -> 'Airdrop':
+        airdrop = cls(bot, document)
+        airdrop.task = asyncio.create_task(airdrop.run())
+        return airdrop
+
+    def progress(self) -> str:
+        return f'Airdrop #{self.id}: sent {self.sent} of {self.total},' \
+            f' {self.failed} failed.'
+
+    async def report(self, content):
+        # Reporting should never stop the airdrop.
+        try:
+            if self._report is None:
+                channel = await self.bot.fetch_channel(self.channel_id)
+                self._report = await outbound.send(channel,
+                    Priority.AIRDROP, content=content)
+            else:
+                await outbound.edit(self._report, Priority.AIRDROP,
+                    content=content)
+        except Exception as error:
+            logger.warning('Could not report on airdrop #%s: %s',
+                self.id, error)
+
+    async def run(self):
+        try:
+            deliveries = await adb.write(take_deliveries, self.id)
+            self.total = len(deliveries)
+            await self.report(self.progress())
+
+            users = await self.bot.fetch_users(
+                delivery['user_id'] for delivery in deliveries)
+
+            semaphore = asyncio.Semaphore(AIRDROP_CONCURRENCY)
+            async def deliver(delivery):
+                async with semaphore:
+                    await self.deliver(delivery, users.get(delivery['user_id']))
+                done = self.sent + self.failed
+                if done % AIRDROP_PROGRESS_EVERY == 0:
+                    await self.report(self.progress())
+
+            tasks = [asyncio.ensure_future(deliver(d)) for d in deliveries]
+            try:
+                await asyncio.gather(*tasks)
+            except BaseException:
+                # Nothing may still be sending once this stops, otherwise a
+                # resume would send the same codes again.
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                raise
+            await self.finish()
+        except Exception as error:
+            # It stays unfinished, so `/airdrop` resumes it rather than
+            # giving every curator another code.
+            logger.exception('Airdrop #%s stopped', self.id)
+            await self.report(f'Airdrop #{self.id} stopped: {error}.'
+                ' Use /airdrop to resume it.')
+
+    async def deliver(self, delivery, user):
+        user_id = delivery['user_id']
+        try:
+            if user is None:
+                raise LookupError('Unknown user')
+
+            await adb.write(start_sending, delivery.doc_id)
+            await outbound.send(user, Priority.AIRDROP,
+                content=THANK_YOU.format(url=CLAIM_URL + delivery['code']))
+        except Exception as error:
+            # One curator should not stop the rest e.g., closed DMs.
+            logger.warning('Could not send %s their code: %s', user_id, error)
+            await adb.write(set_state, delivery.doc_id, FAILED, str(error))
+            self.failed += 1
+        else:
+            await adb.write(set_state, delivery.doc_id, SENT)
+            self.sent += 1
+
+    async def finish(self):
+        users = await adb.write(finish_airdrop, self.id)
+        lines = [f'Airdrop #{self.id} is done: sent {len(users[SENT])}.']
+        if users[FAILED]:
+            lines.append(f'Failed to reach {mentions(users[FAILED])}.')
+        if users[UNKNOWN]:
+            lines.append('May or may not have reached'
+                f' {mentions(users[UNKNOWN])}.')
+        if self.unassigned:
+            lines.append(f'Ran out of codes for {self.unassigned} curators.')
+
+        logger.info(' '.join(lines))
+        await self.report('\n'.join(lines))
@@ -1,7 +1,10 @@
-from helpers import get_prefix, get_token
+from helpers import get_prefix, get_token, embed_cache
 from discord_slash import SlashCommand
 from discord.ext import commands
-from constants import EXTENSIONS
+from reactions import ReactionDispatcher
+from cache import TTLCache
+from constants import *
+import asyncio
 import logging
 
 logger = logging.getLogger(__name__)
@@ -10,6 +13,13 @@ class Bot(commands.Bot):
     def __init__(self):
         super().__init__(command_prefix=get_prefix)
         SlashCommand(self, sync_commands=True)
+        self.reactions = ReactionDispatcher(self)
+
+        # Objects fetched over REST which are not in the library's cache.
+        self.message_cache = TTLCache(MESSAGE_CACHE_SIZE, MESSAGE_CACHE_TTL)
+        self.user_cache = TTLCache(USER_CACHE_SIZE, USER_CACHE_TTL)
+        self.channel_cache = TTLCache(CHANNEL_CACHE_SIZE, CHANNEL_CACHE_TTL)
+
         self.load_extensions()
 
     def load_extensions(self):
@@ -22,11 +32,89 @@ class Bot(commands.Bot):
             await super().fetch_guild(guild_id)
 
     async def fetch_channel(self, channel_id):
-        return self.get_channel(channel_id) or \
-            await super().fetch_channel(channel_id)
+        channel = self.get_channel(channel_id) or \
+            self.channel_cache.get(channel_id)
+        if channel is None:
+            channel = await super().fetch_channel(channel_id)
+            self.channel_cache.put(channel_id, channel)
+        return channel
+
+    async def fetch_user(self, user_id):
+        user = self.get_user(user_id) or self.user_cache.get(user_id)
+        if user is None:
+            user = await super().fetch_user(user_id)
+            self.user_cache.put(user_id, user)
+        return user
+
+    async def fetch_users(self, user_ids) -> dict:
+        """Gets many users at once. Users in either cache are used as they are
+        and the rest are fetched concurrently, a few at a time. Users that
+        cannot be fetched are left out.
+
+        :param user_ids: The ids of the users.
+        :type user_ids: Iterable[int]
+        :return: Maps user ids onto users.
+        :rtype: Dict[int, discord.User]
+        """
+        users = {}
+        missing = []
+        for user_id in user_ids:
+            user = self.get_user(user_id) or self.user_cache.get(user_id)
+            if user is None:
+                missing.append(user_id)
+            else:
+                users[user_id] = user
+
+        semaphore = asyncio.Semaphore(USER_FETCH_CONCURRENCY)
+        async def fetch(user_id):
+            async with semaphore:
+                return await commands.Bot.fetch_user(self, user_id)
+
+        results = await asyncio.gather(*map(fetch, missing),
+            return_exceptions=True)
+        for user_id, result in zip(missing, results):
+            if isinstance(result, Exception):
+                logger.warning('Could not fetch user %s: %s', user_id, result)
+            else:
+                self.user_cache.put(user_id, result)
+                users[user_id] = result
+
+        return users
+
+    async def fetch_message(self, channel_id, message_id):
+        key = (channel_id, message_id)
+        message = self.message_cache.get(key)
+        if message is None:
+            channel = await self.fetch_channel(channel_id)
+            message = await channel.fetch_message(message_id)
+            self.message_cache.put(key, message)
+        return message
+
+    def cache_stats(self) -> dict:
+        return {
+            'messages': self.message_cache.stats(),
+            'users':    self.user_cache.stats(),
+            'channels': self.channel_cache.stats(),
+            'embeds':   embed_cache.stats()
+        }
     
     def run(self):
         super().run(get_token(), reconnect=True)
     
     async def on_ready(self):
         logger.info('Logged in as %s', self.user)
+
+    async def on_raw_reaction_add(self, payload):
+        await self.reactions.dispatch(payload)
+
+    async def on_raw_message_edit(self, payload):
+        key = (payload.channel_id, payload.message_id)
+        self.message_cache.invalidate(key)
+
+    async def on_raw_message_delete(self, payload):
+        key = (payload.channel_id, payload.message_id)
+        self.message_cache.invalidate(key)
+
+    async def on_raw_bulk_message_delete(self, payload):
+        for message_id in payload.message_ids:
+            self.message_cache.invalidate((payload.channel_id, message_id))
@@ -0,0 +1,79 @@
+from collections import OrderedDict
+import time
+
+class LRUCache:
+    """A dictionary that is bounded by size, evicting the least recently used
+    entry first. Keeps count of hits and misses.
+
+    Example:
+
+        `cache = LRUCache(maxsize=512)`
+    """
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def get(self, key, default=None):
+        if key not in self._entries:
+            self.misses += 1
+            return default
+
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return self._entries[key]
+
+    def put(self, key, value):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, key):
+        self._entries.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self) -> str:
+        return (f'{len(self)}/{self.maxsize} entries, {self.hits} hits,'
+            f' {self.misses} misses ({self.hit_rate:.0%})')
+
+class TTLCache(LRUCache):
+    """A dictionary that is bounded by size, evicting the least recently used
+    entry first, and by age, so that entries expire after `ttl` seconds.
+
+    Example:
+
+        `cache = TTLCache(maxsize=1024, ttl=300)`
+    """
+    def __init__(self, maxsize, ttl):
+        super().__init__(maxsize)
+        self.ttl = ttl
+
+    def get(self, key, default=None):
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] < time.monotonic():
+            del self._entries[key]
+            entry = None
+
+        if entry is None:
+            self.misses += 1
+            return default
+
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    def put(self, key, value):
+        super().put(key, (time.monotonic() + self.ttl, value))
@@ -1,10 +1,82 @@
-import json
 from discord.ext import commands
-from database import MESSAGES_TABLE_NAME, db, is_admin
+from database import MessageStatus, adb, db, is_admin
+from export import EXPORT_FORMATS, Selection, export_messages
+from columnar import COLUMNAR_FORMATS, available, best_format, \
+    export_columnar
+from outbound import outbound
 from pathlib import Path, PurePath
 from datetime import datetime
 import discord
 
+def toggle_admin(user):
+    document = db.user(user)
+    document.is_admin = not document.is_admin
+
+def parse_options(options) -> dict:
+    """Turns arguments like `format=ndjson` into a dictionary.
+
+    :param options: Any arguments given to a command.
+    :type options: Iterable[str]
+    :return: Maps option names onto their values.
+    :rtype: dict
+    """
+    parsed = {}
+    for option in options:
+        name, separator, value = option.partition('=')
+        if not separator:
+            raise commands.BadArgument(f'Expected name=value, got {option}.')
+        parsed[name.lower()] = value
+    return parsed
+
+# Maps `.export` options onto the message fields that they filter on.
+ID_FILTERS = {
+    'guild':   'guild__id',
+    'channel': 'channel__id',
+    'curator': 'metadata__curated_by__id'
+}
+
+STATUS_FILTERS = {
+    'approved':  MessageStatus.APPROVED,
+    'anonymous': MessageStatus.ANONYMOUS
+}
+
+def make_selection(options) -> Selection:
+    """Turns the filters given to `.export` into a `Selection` e.g.,
+    `guild=1234 status=approved after=2021-06-01 before=2021-07-01`.
+
+    :param options: The output of `parse_options`.
+    :type options: dict
+    :rtype: Selection
+    """
+    equal = {}
+    for name, field in ID_FILTERS.items():
+        if name in options:
+            if not options[name].isdigit():
+                raise commands.BadArgument(
+                    f'{name.capitalize()} must be an id.')
+            equal[field] = int(options[name])
+
+    status = options.get('status')
+    if status is not None and status not in STATUS_FILTERS:
+        raise commands.BadArgument('Status must be one of'
+            f' {", ".join(STATUS_FILTERS)}.')
+
+    # Dates are compared as ISO strings, so `after` includes its day and
+    # `before` does not.
+    for name in ('after', 'before'):
+        if name in options:
+            try:
+                datetime.fromisoformat(options[name])
+            except ValueError:
+                raise commands.BadArgument(
+                    f'{name.capitalize()} must be a date.')
+
+    selection = Selection(status=STATUS_FILTERS.get(status), **equal)
+    if 'after' in options or 'before' in options:
+        selection.between('added_at', options.get('after'),
+            options.get('before'))
+    return selection
+
 class AdminCog(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
@@ -13,56 +85,105 @@ class AdminCog(commands.Cog):
     @commands.is_owner()
     async def bootstrap(self, ctx):
         """Makes the owner of the bot an admin."""
-        db.user(ctx.author).is_admin = True
+        await adb.write(setattr, db.user(ctx.author), 'is_admin', True)
         await ctx.message.add_reaction('👍')
     
     @commands.command()
     @commands.check(is_admin)
     async def admin(self, ctx, user: discord.User=None):
         """Makes a user an admin or demotes them if they are an admin."""
-        db.user(user).is_admin = not db.user(user).is_admin
+        await adb.write(toggle_admin, user)
         await ctx.message.add_reaction('👍')
 
     @commands.command()
     @commands.check(is_admin)
-    async def export(self, ctx):
-        """Gives the callee all of the curated data."""
+    async def stats(self, ctx):
+        """Shows how well the bot's caches are doing, how much is waiting to
+        be sent and how many codes are left."""
+        lines = [f'{name}: {stats}'
+            for name, stats in self.bot.cache_stats().items()]
+        lines.append(f'outbound: {outbound.stats()}')
+        lines.append(f'codes: {db.codes.remaining} unclaimed')
+        await ctx.reply(content='\n'.join(lines))
+
+    @commands.command()
+    @commands.check(is_admin)
+    async def curators(self, ctx, limit: int=10):
+        """Shows the most active curators and when they were active."""
+        curators = await adb.read(db.get_curators)
+        lines = [f'{len(curators)} curators.']
+        for curator in curators[:limit]:
+            first, last = curator['first_at'] or '?', curator['last_at'] or '?'
+            lines.append(f'{curator["name"]}#{curator["discriminator"]}:'
+                f' {curator["count"]} from {first[:10]} to {last[:10]}')
+        await ctx.reply(content='\n'.join(lines))
+
+    @commands.command()
+    @commands.check(is_admin)
+    async def export(self, ctx, *options):
+        """Gives the callee all of the curated data as gzip-compressed parts.
+        Use `format=ndjson` for newline-delimited JSON instead of arrays,
+        `format=columnar` for column tables (Parquet, or npz without pyarrow)
+        and `since=last` for only what changed since your last export. Filter
+        with `guild=`, `channel=`, `curator=`, `status=approved|anonymous` and
+        `after=`/`before=` dates. `format=parquet|npz` picks one explicitly."""
         if ctx.guild:
             return await ctx.reply('This command must be run in DMs.')
 
+        # Raised from inside the command, so they would not reach the user.
+        try:
+            options = parse_options(options)
+            selection = make_selection(options)
+        except commands.BadArgument as error:
+            return await ctx.reply(str(error))
+        format = options.get('format', 'json')
+        formats = EXPORT_FORMATS + COLUMNAR_FORMATS + ('columnar',)
+        if format == 'columnar':
+            # Parquet if possible, otherwise npz.
+            format = best_format()
+            if format is None:
+                return await ctx.reply('No columnar format is installed.')
+        elif format not in formats:
+            return await ctx.reply(f'Format must be one of {formats}.')
+        if format in COLUMNAR_FORMATS and not available(format):
+            return await ctx.reply(f'The {format} format is not installed.')
+
+        since = options.get('since')
+        if since == 'last':
+            since = await adb.read(lambda: db.user(ctx.author).export_cursor)
+        elif since is not None and not since.isdigit():
+            return await ctx.reply('Since must be `last` or a number.')
+        elif since is not None:
+            since = int(since)
+
         # Show that the command was successfully received.
         await ctx.message.add_reaction('👍')
 
-        exported = []
-        for document in db.handle.table(MESSAGES_TABLE_NAME):
-
-            # Add all comments to this message.
-            if 'comments' not in document:
-                document['comments'] = []
-            
-            message = db.message(
-                channel_id=document.get('original_cid'),
-                message_id=document.get('original_mid')
-            )
-
-            for comment in message.comments:
-                document['comments'].append(comment)
-            
-            # Add to resulting list.
-            exported.append(document)
-        
         # Make the folder if it does not exist.
         folder = Path('exports')
         folder.mkdir(exist_ok=True)
 
-        # Write to a file.
-        filename = folder / f'{datetime.utcnow().isoformat()}.json'
-        with open(filename, 'w') as file:
-            json.dump(exported, file, indent=4)
+        # Write to files that each fit in a single attachment.
+        stem = folder / datetime.utcnow().isoformat()
+        until = await adb.read(lambda: db.sequence.value)
+        # Filtered exports leave out changes, so they must not move the cursor.
+        filtered = not selection.everything
+        if since is not None:
+            selection.between('seq', since + 1, until)
+        if format in COLUMNAR_FORMATS:
+            parts = await export_columnar(stem, format, selection)
+        else: # JSON.
+            parts = await export_messages(stem, format, selection)
 
         # Send to callee.
-        with open(filename, 'r') as file:
-            await ctx.send(file=discord.File(file))
+        for number, part in enumerate(parts, start=1):
+            await ctx.send(content=f'Part {number} of {len(parts)}'
+                f' (up to #{until})', file=discord.File(part))
+
+        # The next `since=last` export starts from here.
+        if not filtered:
+            await adb.write(setattr, db.user(ctx.author), 'export_cursor',
+                until)
 
 def setup(bot):
     cog = AdminCog(bot)
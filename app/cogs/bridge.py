@@ -1,13 +1,163 @@
 from helpers import message_to_embed
-from typing import Generator, Optional
+from typing import Dict, List, Optional
 from discord.channel import TextChannel
 from discord.ext import commands
-from database import is_admin, db
+from database import is_admin, adb, db
+from outbound import Priority, outbound
+from discord.http import Route
+from collections import deque
+from constants import *
 import discord
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# Discord's limits on the embeds in one message.
+MAX_EMBEDS = 10
+MAX_EMBED_CHARACTERS = 6000
+
+# What a group's queue does when it is full.
+DROP_OLDEST = 'drop-oldest'
+# Drops the oldest and tells the group how many were skipped.
+SUMMARIZE   = 'summarize'
+# Drops everything and stops bridging the group for a while.
+PAUSE       = 'pause'
+OVERLOAD_POLICIES = (DROP_OLDEST, SUMMARIZE, PAUSE)
+
+def split_embeds(embeds, size=MAX_EMBEDS) -> List[List[dict]]:
+    """Splits embeds into batches that can each be sent as one message.
+
+    :param embeds: The embeds in the order they should arrive.
+    :type embeds: List[discord.Embed]
+    :param size: The most embeds in a batch, at most 10.
+    :type size: int
+    :return: Batches of embeds as dictionaries.
+    :rtype: List[List[dict]]
+    """
+    batches, characters = [[]], 0
+    for embed in embeds:
+        # Discord also limits the characters across every embed.
+        length = len(embed)
+        if len(batches[-1]) >= min(size, MAX_EMBEDS) or \
+            characters + length > MAX_EMBED_CHARACTERS:
+            batches.append([])
+            characters = 0
+
+        batches[-1].append(embed.to_dict())
+        characters += length
+
+    return [batch for batch in batches if batch]
+
+class GroupQueue:
+    """Messages waiting to be bridged to the rest of one group. The queue holds
+    at most `size` messages and, once it is full, makes room according to
+    `policy`, so a flooded channel is bounded in how far behind it can get.
+
+    Example:
+
+        `queue = GroupQueue('research', size=100, policy=SUMMARIZE)`
+    """
+    def __init__(self, group, size=BRIDGE_QUEUE_SIZE,
+        policy=BRIDGE_OVERLOAD_POLICY):
+        if policy not in OVERLOAD_POLICIES:
+            raise ValueError(f'Unknown overload policy {policy!r}')
+
+        self.group = group
+        self.size = size
+        self.policy = policy
+        # Pairs of when each message arrived and the message.
+        self.messages = deque()
+        self.received = 0
+        self.replicated = 0
+        self.dropped = 0
+        # Dropped since the group was last told, see `SUMMARIZE`.
+        self.skipped = 0
+        self.paused_until = 0.0
+        self.task = None
+        self._ready = asyncio.Event()
+
+    @property
+    def paused(self) -> bool:
+        return self.paused_until > time.monotonic()
+
+    @property
+    def lag(self) -> float:
+        """How many seconds the oldest waiting message has waited."""
+        if not self.messages:
+            return 0.0
+        return time.monotonic() - self.messages[0][0]
+
+    def put(self, message):
+        self.received += 1
+        if not self.paused and len(self.messages) >= self.size:
+            self.overflow()
+
+        if self.paused:
+            self.dropped += 1
+            return
+
+        self.messages.append((time.monotonic(), message))
+        self._ready.set()
+
+    def overflow(self):
+        if self.policy == PAUSE:
+            logger.warning('Pausing %s for %ss after %s messages backed up',
+                self.group, BRIDGE_PAUSE_DURATION, len(self.messages))
+            self.dropped += len(self.messages)
+            self.messages.clear()
+            self.paused_until = time.monotonic() + BRIDGE_PAUSE_DURATION
+            return
+
+        self.messages.popleft()
+        self.dropped += 1
+        if self.policy == SUMMARIZE:
+            self.skipped += 1
+
+    async def take(self, limit, window) -> list:
+        """Waits for messages and takes up to `limit` of them, giving a burst
+        up to `window` seconds from its first message to build up.
+
+        :return: The messages in the order they arrived.
+        :rtype: List[discord.Message]
+        """
+        while True:
+            while not self.messages:
+                self._ready.clear()
+                await self._ready.wait()
+
+            delay = self.messages[0][0] + window - time.monotonic()
+            if len(self.messages) < limit and delay > 0:
+                await asyncio.sleep(delay)
+
+            # Messages may have been dropped in the meantime.
+            count = min(limit, len(self.messages))
+            if count:
+                return [self.messages.popleft()[1] for _ in range(count)]
+
+    def take_skipped(self) -> int:
+        skipped, self.skipped = self.skipped, 0
+        return skipped
+
+    def stats(self) -> str:
+        text = (f'{len(self.messages)}/{self.size} queued,'
+            f' {self.lag:.1f}s behind, {self.replicated} of {self.received}'
+            f' bridged, {self.dropped} dropped ({self.policy})')
+        if self.paused:
+            text += f', paused for {self.paused_until - time.monotonic():.0f}s'
+        return text
 
 class BridgeCog(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
+        # Each group is bridged in order by its own task.
+        self.queues: Dict[str, GroupQueue] = {}
+
+    def cog_unload(self):
+        for queue in self.queues.values():
+            if queue.task is not None:
+                queue.task.cancel()
 
     @commands.command()
     @commands.check(is_admin)
@@ -18,35 +168,103 @@ class BridgeCog(commands.Cog):
         if channel is None:
             channel = ctx.channel
 
+        document = db.channel(channel=channel)
         if group is not None:
-            db.channel(channel=channel).group = group
+            await adb.write(setattr, document, 'group', group)
         else: # Delete group.
-            del db.channel(channel=channel).group
-        
+            await adb.write(delattr, document, 'group')
+
         await ctx.message.add_reaction('👍')
 
+    @commands.command()
+    @commands.check(is_admin)
+    async def bridges(self, ctx):
+        """Shows how far behind each group is and how much has been dropped."""
+        lines = [f'{group}: {queue.stats()}'
+            for group, queue in sorted(self.queues.items())]
+        await ctx.reply(content='\n'.join(lines) or 'Nothing bridged yet.')
+
     @commands.Cog.listener()
     async def on_message(self, message):
         group = self.get_group(message.channel)
         if group is not None and message.author != self.bot.user:
-            await self.replicate_in_group(message, group)
-    
-    async def replicate_in_group(self, message, group):
+            self.get_queue(group).put(message)
+
+    def get_queue(self, group) -> GroupQueue:
+        if group not in self.queues:
+            queue = GroupQueue(group)
+            queue.task = asyncio.create_task(self.drain(queue))
+            self.queues[group] = queue
+        return self.queues[group]
+
+    async def drain(self, queue):
+        """Bridges a group's messages as they arrive. A batch is sent to every
+        other channel before the next is taken, so the queue only empties as
+        fast as the group's channels can take it."""
+        while True:
+            messages = await queue.take(BRIDGE_BATCH_SIZE,
+                BRIDGE_COALESCE_WINDOW)
+            try:
+                skipped = queue.take_skipped()
+                if skipped:
+                    await self.send_skipped(queue.group, skipped)
+
+                await self.replicate_in_group(messages, queue.group)
+                queue.replicated += len(messages)
+            except Exception:
+                logger.exception('Could not bridge %s message(s) in %s',
+                    len(messages), queue.group)
+
+    def make_embed(self, message, group) -> discord.Embed:
         embed = message_to_embed(message)
         embed.set_footer(text=f'{group} | {embed.footer.text}')
+        return embed
+
+    async def replicate_in_group(self, messages, group) -> dict:
+        """Sends `messages` to every other channel in `group` concurrently.
+        Each channel gets them in order, up to `BRIDGE_BATCH_SIZE` per message.
+
+        :return: Maps the ids of channels that could not be sent to onto the
+            exception that was raised.
+        :rtype: dict
+        """
+        embeds = [(message.channel.id, self.make_embed(message, group))
+            for message in messages]
+
+        targets = list(db.routes.channels_in(group))
+        results = await asyncio.gather(*(self.send_embeds(channel_id,
+            [embed for source, embed in embeds if source != channel_id])
+            for channel_id in targets), return_exceptions=True)
+
+        # One failing channel should not stop the others.
+        failures = {channel_id: result
+            for channel_id, result in zip(targets, results)
+            if isinstance(result, Exception)}
+        for channel_id, error in failures.items():
+            logger.warning('Could not bridge %s message(s) to %s: %s',
+                len(messages), channel_id, error)
+
+        return failures
+
+    async def send_skipped(self, group, skipped):
+        embed = discord.Embed(description=f'{skipped} messages skipped')
+        embed.set_footer(text=group)
+        await asyncio.gather(*(self.send_embeds(channel_id, [embed])
+            for channel_id in db.routes.channels_in(group)),
+            return_exceptions=True)
 
-        async for channel in self.get_channels_in_group(message.channel, group):
-            if channel != message.channel:
-                await channel.send(embed=embed)
+    async def send_embeds(self, channel_id, embeds):
+        # The library can only send one embed at a time, so this goes to the
+        # endpoint directly.
+        route = Route('POST', '/channels/{channel_id}/messages',
+            channel_id=channel_id)
+        for batch in split_embeds(embeds, BRIDGE_BATCH_SIZE):
+            await outbound.call(Priority.BRIDGE, ('send', channel_id),
+                self.bot.http.request, route, json={'embeds': batch})
 
-    async def get_channels_in_group(self, channel, group):
-        # TODO: Remove `channel` from parameter list.
-        results = db.channel(channel=channel).get_channels_in_group(group)
-        for channel_doc in results:
-            yield await channel_doc.fetch(self.bot)
-    
     def get_group(self, channel) -> Optional[str]:
-        return db.channel(channel=channel).group
+        # Served from memory, so this is cheap for non-bridged channels.
+        return db.routes.group_of(channel.id)
 
 def setup(bot):
     cog = BridgeCog(bot)
@@ -5,6 +5,7 @@ from discord.ext import commands
 from datetime import datetime
 from database import *
 from helpers import *
+from outbound import Priority, outbound
 import discord
 import logging
 import asyncio
@@ -21,9 +22,109 @@ def has_been_curated_before(message) -> bool:
     """
     return db.message(message).status is not None
 
+def mark_curated(message, reactor) -> Optional[MessageRecord]:
+    """Marks `message` as curated by `reactor`. Checking and setting the
+    status happen in one database call so that no one can curate twice.
+
+    :return: The record of the message or `None` if it was curated before.
+    :rtype: Optional[MessageRecord]
+    """
+    record = db.load_message(message)
+    if record.status is not None:
+        return None
+
+    # Avoid curating this message again and add extra metadata.
+    curated_at = datetime.utcnow().isoformat()
+    record.status = MessageStatus.CURATED
+    record.add_metadata({
+        'curated_by': {
+            'name':          reactor.name,
+            'discriminator': reactor.discriminator,
+            'id':            reactor.id
+        },
+        'curated_at': curated_at
+    })
+
+    with db.transaction():
+        record.flush()
+        db.record_curation(reactor, curated_at)
+    return record
+
+def mark_requested(original, requester) -> Optional[MessageRecord]:
+    """Moves `original` from curated to requested. Like `mark_curated`, this
+    can only happen once.
+
+    :return: The record of `original` or `None` if it was not curated.
+    :rtype: Optional[MessageRecord]
+    """
+    record = db.load_message(original)
+    if record.status != MessageStatus.CURATED:
+        return None
+
+    record.status = MessageStatus.REQUESTED
+
+    # Add extra metadata.
+    record.add_metadata({
+        'requested_by': {
+            'name':          requester.name,
+            'discriminator': requester.discriminator,
+            'id':            requester.id
+        },
+        'requested_at': datetime.utcnow().isoformat()
+    })
+
+    record.flush()
+    return record
+
+def mark_fulfilled(original, custom_id, message) -> Optional[MessageRecord]:
+    """Sets the status of `original` based on the button that its author
+    pressed and, if they gave permission, saves `message`. Like
+    `mark_curated`, this can only happen once.
+
+    :param message: The message that `original` refers to.
+    :type message: discord.Message
+    :return: The record of `original` or `None` if it was fulfilled before.
+    :rtype: Optional[MessageRecord]
+    """
+    # Only works because `MessageStatus.APPROVED` is integer-wise less than
+    # the others.
+    record = db.load_message(original)
+    if record.status >= MessageStatus.APPROVED:
+        return None
+
+    # Add extra metadata.
+    record.add_metadata({
+        'fulfilled_at': datetime.utcnow().isoformat()
+    })
+
+    if custom_id == YES_CUSTOM_ID:
+        record.status = MessageStatus.APPROVED
+    elif custom_id == YES_ANONYMOUSLY_CUSTOM_ID:
+        record.status = MessageStatus.ANONYMOUS
+    else: # User denied permission.
+        record.status = MessageStatus.DENIED
+
+    with db.transaction():
+        if record.status != MessageStatus.DENIED:
+            original.save_message(message,
+                anonymize=record.status == MessageStatus.ANONYMOUS)
+        record.flush()
+    return record
+
+def link_approved(message, approved):
+    # Tie original and approved messages together and make it commentable.
+    with db.transaction():
+        db.message(message).approved_message = approved
+        db.message(approved).original_message.add_comment_hook(approved)
+
 class CuratorCog(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
+        self.bot.reactions.register(CURATION_EMOJI, self.on_curation_reaction,
+            dms=False)
+
+    def cog_unload(self):
+        self.bot.reactions.unregister(self.on_curation_reaction)
 
     @commands.command()
     @commands.check(is_admin)
@@ -34,8 +135,8 @@ class CuratorCog(commands.Cog):
         if guild is None:
             guild = ctx.guild
         
-        db.guild(guild).pending_channel = pending
-        db.guild(guild).approved_channel = approved
+        await adb.write(setattr, db.guild(guild), 'pending_channel', pending)
+        await adb.write(setattr, db.guild(guild), 'approved_channel', approved)
 
         await ctx.message.add_reaction('👍')
 
@@ -47,11 +148,11 @@ class CuratorCog(commands.Cog):
         if guild is None:
             guild = ctx.guild
 
-        pending = db.guild(guild).pending_channel
+        pending = await adb.read(lambda: db.guild(guild).pending_channel)
         if pending:
             pending = await pending.fetch(self.bot)
         
-        approved = db.guild(guild).approved_channel
+        approved = await adb.read(lambda: db.guild(guild).approved_channel)
         if approved:
             approved = await approved.fetch(self.bot)
 
@@ -85,19 +186,13 @@ approved={approved_text}
             return logger.debug('Message %s/%s is not commentable',
                 hook.channel_id, hook.message_id)
         
-        hook.original_message.add_comment(message.author, message.content)
-        await message.add_reaction('👍')
-
-    @commands.Cog.listener()
-    async def on_raw_reaction_add(self, payload):
-        # Do not proceed if it was our own reaction.
-        reactor = await self.bot.fetch_user(payload.user_id)
-        if reactor == self.bot.user:
-            return logger.debug('Ignoring own reaction on %s/%s',
-                payload.channel_id, payload.message_id)
+        await adb.write(lambda: hook.original_message.add_comment(
+            message.author, message.content))
+        await outbound.react(message, Priority.CURATION, '👍')
 
-        channel = await self.bot.fetch_channel(payload.channel_id)
-        message = await channel.fetch_message(payload.message_id)
+    async def on_curation_reaction(self, message, payload):
+        # Only called for guilds, where the payload includes the member.
+        reactor = payload.member or await self.bot.fetch_user(payload.user_id)
 
         # Delegate to other method.
         await self.on_emoji_add(message, str(payload.emoji), reactor)
@@ -114,7 +209,7 @@ approved={approved_text}
                 message.channel.id, message.id)
         
         # Ensure message has not been curated before.
-        if has_been_curated_before(message):
+        if await adb.read(has_been_curated_before, message):
             return logger.debug('%s/%s has already been curated before',
                 message.channel.id, message.id)
         
@@ -122,7 +217,8 @@ approved={approved_text}
 
     async def start_curation(self, message, reactor):
         # Get the pending channel for this server.
-        channel = db.guild(message.guild).pending_channel
+        channel = await adb.read(lambda:
+            db.guild(message.guild).pending_channel)
         if channel is None:
             return logger.debug('Pending channel for %s is not set',
                 message.guild.id)
@@ -130,25 +226,19 @@ approved={approved_text}
             # Turn document into real channel.
             channel = await channel.fetch(self.bot)
 
-        # Avoid curating this message again and add extra metadata.
-        db.message(message).status = MessageStatus.CURATED
-        db.message(message).add_metadata({
-            'curated_by': {
-                'name':          reactor.name,
-                'discriminator': reactor.discriminator,
-                'id':            reactor.id
-            },
-            'curated_at': datetime.utcnow().isoformat()
-        })
+        if await adb.write(mark_curated, message, reactor) is None:
+            return logger.debug('%s/%s was curated in the meantime',
+                message.channel.id, message.id)
 
         # Send to the pending channel.
-        pending = await channel.send(
+        pending = await outbound.send(channel, Priority.CURATION,
             embed=message_to_embed(message),
             components=[make_pending_action_row()]
         )
 
         # Tie original and pending messages together.
-        db.message(message).pending_message = pending
+        await adb.write(setattr, db.message(message), 'pending_message',
+            pending)
     
     @cog_ext.cog_component(components=[
         REQUEST_PERMISSION_CUSTOM_ID, 
@@ -159,24 +249,13 @@ approved={approved_text}
         await ctx.defer(ignore=True)
 
         # Ensure no one can click this button twice.
-        original = db.message(ctx.origin_message).original_message
-        if original.status != MessageStatus.CURATED:
+        original = await adb.read(lambda:
+            db.message(ctx.origin_message).original_message)
+        if await adb.write(mark_requested, original, ctx.author) is None:
             return logger.error('Observer %s tried to request permission'
                 ' twice for %s/%s', ctx.author.id, original.channel_id,
                 original.message_id)
         else:
-            original.status = MessageStatus.REQUESTED
-
-            # Add extra metadata.
-            original.add_metadata({
-                'requested_by': {
-                    'name':          ctx.author.name,
-                    'discriminator': ctx.author.discriminator,
-                    'id':            ctx.author.id
-                },
-                'requested_at': datetime.utcnow().isoformat()
-            })
-
             original = await original.fetch(self.bot)
 
         # Disable the buttons and make the actual request.
@@ -192,10 +271,10 @@ approved={approved_text}
         if `user` replies, a comment will be added to `original` in database."""
         embed = message_to_embed(original)
         add_commentable_message(embed)
-        hook = await user.send(embed=embed)
+        hook = await outbound.send(user, Priority.CURATION, embed=embed)
 
         # Register the message that we just sent as commentable.
-        db.message(original).add_comment_hook(hook)
+        await adb.write(db.message(original).add_comment_hook, hook)
 
     async def send_permission_request(self, message):
         # Send an introduction if we haven't met this person yet.
@@ -208,13 +287,14 @@ approved={approved_text}
         embed = message_to_embed(message)
         add_introduction_field(embed, message.guild)
         add_consent_message(embed)
-        request = await message.author.send(
+        request = await outbound.send(message.author, Priority.CONSENT,
             embed=embed,
             components=[make_request_action_row()]
         )
 
         # Tie original and request messages together.
-        db.message(message).request_message = request
+        await adb.write(setattr, db.message(message), 'request_message',
+            request)
 
     @cog_ext.cog_component(components=[
         YES_CUSTOM_ID,
@@ -225,76 +305,81 @@ approved={approved_text}
         # Avoids 'This interaction failed'.
         await ctx.defer(ignore=True)
 
-        # Ensure button cannot be pressed twice.
-        original = db.message(ctx.origin_message).original_message
-        if db.message(original).status >= MessageStatus.APPROVED:
-
-            # Only works because `MessageStatus.APPROVED` is integer-wise
-            # less than the others.
+        # Ensure button cannot be pressed twice. The message is fetched first
+        # so that it is saved along with the new status.
+        document = await adb.read(lambda:
+            db.message(ctx.origin_message).original_message)
+        original = await document.fetch(self.bot)
+        record = await adb.write(mark_fulfilled, document, ctx.custom_id,
+            original)
+        if record is None:
             return logger.error('User %s tried to fulfill twice for %s/%s',
-                ctx.author.id, original.channel_id, original.message_id)
-        
-        # Add extra metadata.
-        original.add_metadata({
-            'fulfilled_at': datetime.utcnow().isoformat()
-        })
-
-        # Set the appropriate status and add to database.
-        if ctx.custom_id == YES_CUSTOM_ID:
-            original.status = MessageStatus.APPROVED
-            await original.add_to_database(self.bot)
-        elif ctx.custom_id == YES_ANONYMOUSLY_CUSTOM_ID:
-            original.status = MessageStatus.ANONYMOUS
-            await original.add_to_database(self.bot, anonymize=True)
+                ctx.author.id, document.channel_id, document.message_id)
+
+        # None of these depend on each other, only on what was just saved, so
+        # they run at the same time. The embed is rendered once and shared.
+        granted = ctx.custom_id != NO_CUSTOM_ID
+        steps = {
+            'disable the buttons': disable_request_action_row(
+                ctx.origin_message),
+            'send thanks': send_thanks(original.author, granted,
+                original.guild),
+            'delete the pending message': self.delete_pending(record)
+        }
+
+        if granted:
+            anonymous = (ctx.custom_id == YES_ANONYMOUSLY_CUSTOM_ID)
+            embed = message_to_embed(original, anonymize=anonymous)
+            steps['send to approved'] = self.send_to_approved(original,
+                anonymous=anonymous, embed=embed)
+            steps['send to bridge'] = self.send_to_bridge(original,
+                anonymous=anonymous, embed=embed)
         else: # User denied permission.
-            original.status = MessageStatus.DENIED
-        
-        # Disable the buttons and convert to an actual message.
-        await disable_request_action_row(ctx.origin_message)
-        original = await original.fetch(self.bot)
-
-        # Send thanks based on response.
-        if ctx.custom_id == YES_CUSTOM_ID or \
-            ctx.custom_id == YES_ANONYMOUSLY_CUSTOM_ID:
-            await send_thanks(original.author, True, original.guild)
-        else: # User denied permission.
-            await send_thanks(original.author, False, original.guild)
-        
-        # Delete the pending message.
-        pending = await db.message(original).pending_message.fetch(self.bot)
-        await pending.delete()
-
-        # Quit early if user denied permission.
-        if ctx.custom_id == NO_CUSTOM_ID:
-            return logger.info('User %s denied permission for %s/%s',
+            logger.info('User %s denied permission for %s/%s',
                 ctx.author.id, original.channel.id, original.id)
-        
-        # Send to the approved channel.
-        anonymous = (ctx.custom_id == YES_ANONYMOUSLY_CUSTOM_ID)
-        await self.send_to_approved(original, anonymous=anonymous)
-        await self.send_to_bridge(original, anonymous=anonymous)
-    
-    async def send_to_approved(self, message, anonymous=False):
+
+        results = await asyncio.gather(*steps.values(),
+            return_exceptions=True)
+
+        # One failing step should not stop the others.
+        for step, result in zip(steps, results):
+            if isinstance(result, Exception):
+                logger.error('Could not %s for %s/%s', step,
+                    original.channel.id, original.id, exc_info=result)
+
+    async def delete_pending(self, record):
+        if record.pending_message is None:
+            return logger.warning('No pending message for %s/%s',
+                record.channel_id, record.message_id)
+
+        pending = await record.pending_message.fetch(self.bot)
+        await outbound.delete(pending, Priority.CURATION)
+
+    async def send_to_approved(self, message, anonymous=False, embed=None):
         # Get the approved channel for the originating guild.
-        channel = db.guild(message.guild).approved_channel
+        channel = await adb.read(lambda:
+            db.guild(message.guild).approved_channel)
         if channel is None:
             return logger.error('Approved channel for %s is not set',
                 message.guild.id)
         else:
             channel = await channel.fetch(self.bot)
         
-        # Send to the approved channel.
-        embed = message_to_embed(message, anonymize=anonymous)
+        # Send to the approved channel. The embed may be shared, so it is
+        # copied before anything is added to it.
+        if embed is None:
+            embed = message_to_embed(message, anonymize=anonymous)
+        embed = embed.copy()
         add_commentable_message(embed)
-        approved = await channel.send(embed=embed)
+        approved = await outbound.send(channel, Priority.CURATION,
+            embed=embed)
 
-        # Tie original and approved messages together and make it commentable.
-        db.message(message).approved_message = approved
-        db.message(approved).original_message.add_comment_hook(approved)
+        await adb.write(link_approved, message, approved)
 
-    async def send_to_bridge(self, message, anonymous=False):
+    async def send_to_bridge(self, message, anonymous=False, embed=None):
         # Get the bridge channel for the originating guild.
-        channel = db.guild(message.guild).bridge_channel
+        channel = await adb.read(lambda:
+            db.guild(message.guild).bridge_channel)
         if channel is None:
             return logger.error('Bridge channel for %s is not set',
                 message.guild.id)
@@ -302,8 +387,9 @@ approved={approved_text}
             channel = await channel.fetch(self.bot)
         
         # Send to the bridge channel.
-        embed = message_to_embed(message, anonymize=anonymous)
-        await channel.send(embed=embed)
+        if embed is None:
+            embed = message_to_embed(message, anonymize=anonymous)
+        await outbound.send(channel, Priority.BRIDGE, embed=embed)
 
 def setup(bot):
     cog = CuratorCog(bot)
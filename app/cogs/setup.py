@@ -2,15 +2,54 @@ from discord import guild
 from discord.ext import commands
 from discord.ext.commands import cog
 from discord_slash import cog_ext
-from constants import CENTRAL_HUB_ID
+from constants import CENTRAL_HUB_ID, CODES_EMOJI
+from airdrop import CLAIM_URL, Airdrop, unfinished_airdrops
 from database import *
+from outbound import Priority, outbound
+import io
 
 
 logger = logging.getLogger(__name__)
 
+def configure_satellite(guild, channel, bridge, pending, approved):
+    with db.transaction():
+        db.guild(guild).pending_channel = pending
+        db.guild(guild).approved_channel = approved
+        db.guild(guild).bridge_channel = channel
+
+        db.channel(channel=channel).group = guild.name
+        db.channel(channel=bridge).group = guild.name
+
+def parse_codes(data) -> Tuple[List[str], int]:
+    """Pulls the code out of every claim URL in a file, one line at a time.
+
+    :param data: The contents of the file.
+    :type data: bytes
+    :return: The codes and how many lines were not claim URLs.
+    :rtype: Tuple[List[str], int]
+    """
+    codes = []
+    ignored = 0
+    for line in io.TextIOWrapper(io.BytesIO(data), encoding='utf-8',
+        errors='replace'):
+        line = line.strip()
+        if line.startswith(CLAIM_URL):
+            codes.append(line[len(CLAIM_URL):])
+        elif line:
+            ignored += 1
+    return codes, ignored
+
 class SetupCog(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
+        self.bot.reactions.register(CODES_EMOJI, self.on_codes_reaction)
+        self.airdrops = {}
+        self.resumed = False
+        # Held while deciding whether to start, resume or report an airdrop.
+        self._airdrop_lock = asyncio.Lock()
+
+    def cog_unload(self):
+        self.bot.reactions.unregister(self.on_codes_reaction)
     
     @cog_ext.cog_slash(
         name="setup",
@@ -18,7 +57,7 @@ class SetupCog(commands.Cog):
                    872936378118324235]
     )
     async def setup(self, ctx):
-        if not db.user(user=ctx.author).is_admin:
+        if not await adb.read(lambda: db.user(user=ctx.author).is_admin):
             return await ctx.send('Insufficient permissions!')
 
         observatory = self.bot.get_guild(CENTRAL_HUB_ID)
@@ -34,12 +73,8 @@ class SetupCog(commands.Cog):
         approved = await observatory.create_text_channel("Approved Messages", category=category)
 
         # setting channel ids for curation process
-        db.guild(ctx.guild).pending_channel = pending
-        db.guild(ctx.guild).approved_channel = approved
-        db.guild(ctx.guild).bridge_channel = ctx.channel
-        
-        db.channel(channel=ctx.channel).group = ctx.guild.name
-        db.channel(channel=bridge).group = ctx.guild.name
+        await adb.write(configure_satellite, ctx.guild, ctx.channel, bridge,
+            pending, approved)
         
         await ctx.reply("Done!")
 
@@ -49,39 +84,62 @@ class SetupCog(commands.Cog):
                    872936378118324235]
     )
     async def airdrop(self, ctx):
-        async for user in db.get_all_curators(self.bot):
-            url = 'http://POAP.xyz/claim/' + db.pop_compensation_code()
-            await user.send(f'Thank you for your help in advancing Crypto-Goverance research! As a token of our gratitude, please accept this badge that you can add to your crypto wallet! {url}')
+        await ctx.defer()
+        async with self._airdrop_lock:
+            # Only one at a time, otherwise curators could get two codes.
+            running = list(self.airdrops.values())
+            if running:
+                return await ctx.reply(running[0].progress())
+
+            # One that stopped part way is finished before starting another.
+            unfinished = await adb.read(unfinished_airdrops)
+            if unfinished:
+                airdrop = Airdrop.resume(self.bot, unfinished[0])
+                self.track(airdrop)
+                return await ctx.reply(f'Resumed airdrop #{airdrop.id}!'
+                    ' Progress will be posted here.')
 
-        await ctx.reply('Done!')
+            self.track(await Airdrop.start(self.bot, ctx.channel.id))
+        await ctx.reply('Started! Progress will be posted here.')
+
+    def track(self, airdrop):
+        self.airdrops[airdrop.id] = airdrop
+        airdrop.task.add_done_callback(
+            lambda _: self.airdrops.pop(airdrop.id, None))
 
     @commands.Cog.listener()
-    async def on_raw_reaction_add(self, payload):
-        channel = await self.bot.fetch_channel(payload.channel_id)
-        message = await channel.fetch_message(payload.message_id)
-
-        # downloads text file containing POAP claim urls
-        if str(payload.emoji) == '🔗':
-            if message.attachments == []:
-                return logger.debug('Message did not contain a file attachment')
-            else:
-                attachment = message.attachments[0]
-                if attachment.filename.endswith('.txt'):
-                    await attachment.save('temp.txt')
-
-                    poap_codes = []
-                    url_pattern = 'http://POAP.xyz/claim/'
-                    with open('temp.txt') as f:
-                        for line in f.readlines():
-                            if line.startswith(url_pattern):
-                                # extracting code substring to store in db
-                                poap_codes.append(line[len(url_pattern):].rstrip())
-                    
-                    db.insert_compensation_codes(poap_codes)
-
-                    return logger.info('Received file and saved it to memory')
-                else:
-                    return logger.debug('Message did not contain a .txt file')
+    async def on_ready(self):
+        # This is also called after reconnecting.
+        if self.resumed:
+            return
+        self.resumed = True
+
+        for document in await adb.read(unfinished_airdrops):
+            logger.info('Resuming airdrop #%s', document.doc_id)
+            self.track(Airdrop.resume(self.bot, document))
+
+    async def on_codes_reaction(self, message, payload):
+        # Adds the codes from a text file of POAP claim URLs to the pool.
+        if message.attachments == []:
+            return logger.debug('Message did not contain a file attachment')
+
+        attachment = message.attachments[0]
+        if not attachment.filename.endswith('.txt'):
+            return logger.debug('Message did not contain a .txt file')
+
+        # Kept in memory, so uploads at the same time do not collide.
+        data = await attachment.read()
+        loop = asyncio.get_running_loop()
+        codes, ignored = await loop.run_in_executor(None, parse_codes, data)
+        accepted, duplicates = await adb.write(db.insert_compensation_codes,
+            codes)
+
+        logger.info('Added %s codes from %s (%s duplicates, %s ignored)',
+            accepted, attachment.filename, duplicates, ignored)
+        await outbound.reply(message, Priority.CURATION,
+            content=f'Added {accepted} codes, skipped {duplicates}'
+            f' duplicates and {ignored} other lines.'
+            f' {db.codes.remaining} codes are unclaimed.')
 
 def setup(bot):
     cog = SetupCog(bot)
@@ -0,0 +1,282 @@
+from database import STATUSES_TABLE_NAME, adb, db
+from export import read_pages
+from indexes import resolve
+from typing import List, Optional
+from pathlib import Path
+from constants import *
+import asyncio
+import logging
+import zipfile
+import struct
+
+# Both are optional, the archive is written with whichever is installed.
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+logger = logging.getLogger(__name__)
+
+COLUMNAR_FORMATS = ('parquet', 'npz')
+
+# Every column is a field (see `indexes.resolve`) and whether it holds
+# integers or strings.
+MESSAGE_COLUMNS = [
+    ('original_cid',                 'int'),
+    ('original_mid',                 'int'),
+    ('seq',                          'int'),
+    ('status',                       'int'),
+    ('added_at',                     'str'),
+    ('content',                      'str'),
+    ('author_hash',                  'str'),
+    ('author__id',                   'int'),
+    ('author__name',                 'str'),
+    ('author__discriminator',        'str'),
+    ('guild__id',                    'int'),
+    ('guild__name',                  'str'),
+    ('channel__id',                  'int'),
+    ('channel__name',                'str'),
+    ('metadata__curated_by__id',     'int'),
+    ('metadata__curated_by__name',   'str'),
+    ('metadata__curated_at',         'str'),
+    ('metadata__requested_by__id',   'int'),
+    ('metadata__requested_by__name', 'str'),
+    ('metadata__requested_at',       'str'),
+    ('metadata__fulfilled_at',       'str')
+]
+
+COMMENT_COLUMNS = [
+    ('original_cid',          'int'),
+    ('original_mid',          'int'),
+    ('author__id',            'int'),
+    ('author__name',          'str'),
+    ('author__discriminator', 'str'),
+    ('content',               'str')
+]
+
+def available(format) -> bool:
+    return {'parquet': pyarrow, 'npz': numpy}.get(format) is not None
+
+def best_format() -> Optional[str]:
+    """Picks Parquet if pyarrow is installed, otherwise npz if NumPy is.
+
+    :return: The format or `None` if neither is installed.
+    :rtype: Optional[str]
+    """
+    return next((f for f in COLUMNAR_FORMATS if available(f)), None)
+
+# Bytes that each row takes up in a column of either kind, see `write_npz`.
+# Strings count an int64 offset too, as if every one of them were unique.
+ROW_BYTES = {'int': 9, 'str': 12}
+
+class ColumnBuffer:
+    """Collects rows as one list per column, keeping a rough count of how
+    many bytes they will take up once written."""
+    def __init__(self, columns):
+        self.columns = columns
+        self.clear()
+
+    def append(self, document):
+        for name, kind in self.columns:
+            value = resolve(document, name)
+            # Every row costs its fixed size even when the value is missing.
+            self.nbytes += ROW_BYTES[kind]
+            if value is not None:
+                value = int(value) if kind == 'int' else str(value)
+                if kind == 'str':
+                    self.nbytes += len(value.encode('utf-8'))
+            self.values[name].append(value)
+        self.rows += 1
+
+    def clear(self):
+        self.values = {name: [] for name, _ in self.columns}
+        self.nbytes = 0
+        self.rows = 0
+
+def write_parquet(path, columns, values):
+    types = {'int': pyarrow.int64(), 'str': pyarrow.string()}
+    table = pyarrow.table({name: pyarrow.array(values[name], type=types[kind])
+        for name, kind in columns})
+    pyarrow.parquet.write_table(table, str(path))
+
+def write_npz(path, columns, values):
+    """Writes each column as uncompressed arrays, which `open_npz` can
+    memory-map. Integers are stored as `name` with a boolean
+    `name.valid` for missing values. Strings are stored as a string table:
+    `name.codes` points into the table (-1 when missing), and the UTF-8
+    bytes of entry `i` are `name.data[name.offsets[i]:name.offsets[i + 1]]`.
+    """
+    arrays = {}
+    for name, kind in columns:
+        column = values[name]
+        if kind == 'int':
+            arrays[name] = numpy.array([0 if v is None else v
+                for v in column], dtype=numpy.int64)
+            arrays[f'{name}.valid'] = numpy.array([v is not None
+                for v in column], dtype=bool)
+            continue
+
+        # Repeated strings e.g., guild names, are only stored once.
+        table = {}
+        arrays[f'{name}.codes'] = numpy.array([-1 if v is None else
+            table.setdefault(v, len(table)) for v in column], dtype=numpy.int32)
+
+        encoded = [string.encode('utf-8') for string in table]
+        offsets = numpy.zeros(len(encoded) + 1, dtype=numpy.int64)
+        numpy.cumsum([len(e) for e in encoded], out=offsets[1:])
+        arrays[f'{name}.offsets'] = offsets
+        arrays[f'{name}.data'] = numpy.frombuffer(b''.join(encoded),
+            dtype=numpy.uint8)
+
+    numpy.savez(path, **arrays)
+
+def open_npz(path) -> dict:
+    """Memory-maps every array in an archive written by `write_npz`, which
+    `numpy.load` will not do for `.npz` files. This works because
+    `numpy.savez` stores each array uncompressed, so its data is a
+    contiguous run of the file.
+
+    Example:
+
+        `guilds = open_npz('x.messages.npz')['guild__id']`
+
+    :return: Maps column names onto read-only arrays.
+    :rtype: Dict[str, numpy.ndarray]
+    """
+    arrays = {}
+    with zipfile.ZipFile(path) as archive, open(path, 'rb') as file:
+        for info in archive.infolist():
+            if info.compress_type != zipfile.ZIP_STORED:
+                raise ValueError(f'{info.filename} in {path} is compressed')
+
+            # The local header's lengths can differ from the central one's.
+            file.seek(info.header_offset + 26)
+            name_length, extra_length = struct.unpack('<HH', file.read(4))
+            file.seek(info.header_offset + 30 + name_length + extra_length)
+
+            version = numpy.lib.format.read_magic(file)
+            read_header = numpy.lib.format.read_array_header_1_0 \
+                if version == (1, 0) else numpy.lib.format.read_array_header_2_0
+            shape, fortran, dtype = read_header(file)
+
+            name = info.filename[:-len('.npy')]
+            if 0 in shape: # Empty files cannot be mapped.
+                arrays[name] = numpy.empty(shape, dtype=dtype)
+            else:
+                arrays[name] = numpy.memmap(path, dtype=dtype, mode='r',
+                    offset=file.tell(), shape=shape,
+                    order='F' if fortran else 'C')
+    return arrays
+
+def read_npz_strings(archive, name) -> list:
+    """Decodes a string column from an archive written by `write_npz`.
+
+    Example:
+
+        `read_npz_strings(open_npz('x.messages.npz'), 'guild__name')`
+
+    :return: The strings with `None` where they are missing.
+    :rtype: List[Optional[str]]
+    """
+    data = archive[f'{name}.data'].tobytes()
+    offsets = archive[f'{name}.offsets']
+    table = [data[offsets[i]:offsets[i + 1]].decode('utf-8')
+        for i in range(len(offsets) - 1)]
+    return [None if code < 0 else table[code]
+        for code in archive[f'{name}.codes']]
+
+WRITERS = {'parquet': write_parquet, 'npz': write_npz}
+
+class ArchiveWriter:
+    """Writes rows to numbered parts of one table e.g.,
+    `stem.part1.messages.parquet`, starting a new part whenever the buffered
+    rows reach `limit` bytes."""
+    def __init__(self, stem, table, columns, format, limit=EXPORT_PART_SIZE):
+        self.stem = stem
+        self.table = table
+        self.columns = columns
+        self.format = format
+        self.limit = limit
+        self.buffer = ColumnBuffer(columns)
+        self.parts: List[Path] = []
+
+    def write_many(self, documents):
+        for document in documents:
+            self.buffer.append(document)
+            if self.buffer.nbytes >= self.limit:
+                self.flush()
+
+    def flush(self):
+        number = len(self.parts) + 1
+        path = Path(f'{self.stem}.part{number}.{self.table}.{self.format}')
+        WRITERS[self.format](path, self.columns, self.buffer.values)
+        self.parts.append(path)
+        self.buffer.clear()
+
+    def close(self) -> List[Path]:
+        # Always produce at least one (empty) part.
+        if self.buffer.rows or not self.parts:
+            self.flush()
+        return self.parts
+
+def attach_statuses(documents) -> list:
+    statuses = db.table(STATUSES_TABLE_NAME)
+    for document in documents:
+        result = statuses.find_one(original_cid=document.get('original_cid'),
+            original_mid=document.get('original_mid'))
+        document['status'] = None if result is None else result['status']
+    return documents
+
+def comment_rows(documents) -> list:
+    return [{'original_cid': document.get('original_cid'),
+             'original_mid': document.get('original_mid'), **comment}
+        for document in documents for comment in document['comments']]
+
+async def export_columnar(stem, format='parquet', selection=None) \
+    -> List[Path]:
+    """Exports messages and their comments as flat, typed columns, so that
+    analysts can load only the columns they need without parsing JSON.
+    Messages and comments go to separate tables which join on
+    `original_cid` and `original_mid`.
+
+    :param stem: The path of the parts without any suffixes.
+    :type stem: Path
+    :param format: Either 'parquet' (needs pyarrow) or 'npz' (needs NumPy),
+        defaults to 'parquet'.
+    :type format: str
+    :param selection: Only export these messages, defaults to all of them.
+    :type selection: Optional[export.Selection]
+    :return: The paths to the parts of both tables.
+    :rtype: List[Path]
+    """
+    if format not in COLUMNAR_FORMATS:
+        raise ValueError(f'Unknown columnar format {format!r}')
+    if not available(format):
+        raise RuntimeError(f'{format} exports need '
+            f'{"pyarrow" if format == "parquet" else "numpy"} installed')
+
+    loop = asyncio.get_running_loop()
+    messages = ArchiveWriter(stem, 'messages', MESSAGE_COLUMNS, format)
+    comments = ArchiveWriter(stem, 'comments', COMMENT_COLUMNS, format)
+
+    exported = 0
+    async for documents in read_pages(selection):
+        documents = await adb.read(attach_statuses, documents)
+
+        # Converting to arrays is too slow to do on the event loop.
+        await loop.run_in_executor(None, messages.write_many, documents)
+        await loop.run_in_executor(None, comments.write_many,
+            comment_rows(documents))
+        exported += len(documents)
+
+    parts = await loop.run_in_executor(None, messages.close)
+    parts += await loop.run_in_executor(None, comments.close)
+    logger.info('Exported %s messages to %s %s part(s)', exported,
+        len(parts), format)
+    return parts
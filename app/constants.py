@@ -1,7 +1,41 @@
 TOKEN_ENV_NAME = 'DISCORD_API_TOKEN'
-DATABASE_FNAME = 'data.json'
+DATABASE_ENGINE = 'tinydb' # Or 'sqlite' or 'journal'.
+# The journal's snapshot has the same layout as TinyDB's, so they can share a
+# file. Move existing data over to SQLite with `storage.copy_storage`.
+DATABASE_FNAMES = {
+    'tinydb':  'data.json',
+    'sqlite':  'data.sqlite3',
+    'journal': 'data.json'
+}
+DATABASE_FNAME = DATABASE_FNAMES[DATABASE_ENGINE]
+JOURNAL_FSYNC_INTERVAL = 0.2 # Seconds.
+JOURNAL_COMPACT_INTERVAL = 600 # Seconds.
 COMMAND_PREFIX = '.'
+MESSAGE_CACHE_SIZE = 1024
+MESSAGE_CACHE_TTL = 300 # Seconds.
+USER_CACHE_SIZE = 4096
+USER_CACHE_TTL = 3600 # Seconds.
+CHANNEL_CACHE_SIZE = 1024
+CHANNEL_CACHE_TTL = 3600 # Seconds.
+EMBED_CACHE_SIZE = 512
+USER_FETCH_CONCURRENCY = 8
+LIVE_DOCUMENTS_KEPT = 256 # Recently used documents kept in memory.
+OUTBOUND_CONCURRENCY = 8 # REST writes at once.
+OUTBOUND_BUCKETS_KEPT = 1024 # Routes before idle ones are forgotten.
+CHANNEL_SEND_RATE = 5 # Messages per channel every...
+CHANNEL_SEND_PERIOD = 5 # Seconds.
+BRIDGE_COALESCE_WINDOW = 1.0 # Seconds a burst has to build up into a batch.
+BRIDGE_BATCH_SIZE = 10 # Embeds per message, 1 sends every message alone.
+BRIDGE_QUEUE_SIZE = 200 # Messages waiting per group.
+BRIDGE_OVERLOAD_POLICY = 'drop-oldest' # Or 'summarize' or 'pause'.
+BRIDGE_PAUSE_DURATION = 300 # Seconds.
+EXPORT_PAGE_SIZE = 500 # Messages.
+EXPORT_PART_SIZE = 7 * 1024 * 1024 # Bytes, Discord allows up to 8 MiB.
+AIRDROP_CONCURRENCY = 4 # Direct messages at once.
+AIRDROP_PROGRESS_EVERY = 25 # Deliveries between progress updates.
 CENTRAL_HUB_ID = 870551183339696138 # 474736509472473088
+CURATION_EMOJI = '🔭'
+CODES_EMOJI = '🔗'
 EXTENSIONS = [
     'cogs.curator',
     'cogs.admin',
@@ -1,14 +1,19 @@
 from abc import ABC, abstractproperty
 from tinydb.table import Document
-from tinydb.queries import Query
-from tinydb import TinyDB, where
+from storage import open_storage
 from helpers import user_to_hash
 from datetime import datetime
-from typing import Generator, List, Optional
+from typing import Generator, List, Optional, Tuple
+from collections import deque
+from contextlib import contextmanager
 from enum import IntEnum
 from constants import *
+import threading
+import weakref
+import asyncio
 import logging
 import discord
+import queue
 
 logger = logging.getLogger(__name__)
 
@@ -22,13 +27,47 @@ COMMENTS_TABLE_NAME   = 'comments'
 MESSAGES_TABLE_NAME   = 'messages'
 ADMINS_TABLE_NAME     = 'admins'
 BRIDGES_TABLE_NAME    = 'bridges'
+COMPENSATION_TABLE_NAME = 'compensation'
+AIRDROPS_TABLE_NAME   = 'airdrops'
+DELIVERIES_TABLE_NAME = 'deliveries'
+CURATORS_TABLE_NAME   = 'curators'
+
+# Fields that are looked up on the hot paths. Each tuple is turned into a hash
+# index for equality lookups and each string into a sorted index for ranges.
+# Indexes are kept in sync on every write.
+INDEXES = {
+    STATUSES_TABLE_NAME:   [('original_cid', 'original_mid'), ('status',)],
+    ALTERNATES_TABLE_NAME: [('original_cid', 'original_mid'),
+                            ('message_cid', 'message_mid'),
+                            ('message_cid', 'message_mid', 'altype')],
+    COMMENTS_TABLE_NAME:   [('original_cid', 'original_mid'), 'seq'],
+    MESSAGES_TABLE_NAME:   [('original_cid', 'original_mid'), 'seq',
+                            ('guild__id',), ('channel__id',),
+                            ('metadata__curated_by__id',), 'added_at'],
+    CHANNELS_TABLE_NAME:   [('guild_id', 'type')],
+    BRIDGES_TABLE_NAME:    [('channel_id',), ('group',)],
+    AIRDROPS_TABLE_NAME:   [('finished_at',)],
+    DELIVERIES_TABLE_NAME: [('airdrop', 'state')],
+    CURATORS_TABLE_NAME:   [('user_id',)]
+}
 
 class LiveDocument(ABC):
+    # Lots of these are made, so they only have room for their ids. The weak
+    # reference is for `Database.documents`.
+    __slots__ = ('handle', '__weakref__')
+
     def __init__(self, handle, **kwargs):
+        # The `Database` that this document belongs to.
         self.handle = handle
+
+    @staticmethod
+    def identify(*args, **kwargs) -> tuple:
+        """Gets the ids that the constructor would give a document, which
+        is what `Database.documents` is keyed by."""
+        raise NotImplementedError()
     
     @abstractproperty
-    def base_query(self) -> Query:
+    def base_fields(self) -> dict:
         raise NotImplementedError()
 
 class MessageStatus(IntEnum):
@@ -51,36 +90,38 @@ class AlternateType(IntEnum):
     COMMENT = 3
 
 class Message(LiveDocument):
+    __slots__ = ('channel_id', 'message_id', '_original')
+
     def __init__(self, handle, message=None, channel_id=0, message_id=0):
         super().__init__(handle)
-        self.channel_id = channel_id
-        self.message_id = message_id
+        self.channel_id, self.message_id = Message.identify(message,
+            channel_id, message_id)
+        self._original = None
 
+    @staticmethod
+    def identify(message=None, channel_id=0, message_id=0) -> tuple:
         if isinstance(message, discord.Message):
-            self.channel_id = message.channel.id
-            self.message_id = message.id
-        
+            return message.channel.id, message.id
         elif message is not None: # This class.
-            self.channel_id = message.channel_id
-            self.message_id = message.message_id
+            return message.channel_id, message.message_id
+        return channel_id, message_id
     
     @property
-    def base_query(self) -> Query:
-        return (where('original_cid') == self.channel_id) & \
-               (where('original_mid') == self.message_id)
+    def base_fields(self) -> dict:
+        return {'original_cid': self.channel_id,
+                'original_mid': self.message_id}
 
     @property
     def status(self) -> Optional[MessageStatus]:
-        result = self.handle.table(STATUSES_TABLE_NAME).get(self.base_query)
+        table = self.handle.table(STATUSES_TABLE_NAME)
+        result = table.find_one(**self.base_fields)
         return None if result is None else MessageStatus(result['status'])
     
     @status.setter
     def status(self, new_status):
-        self.handle.table(STATUSES_TABLE_NAME).upsert({
-            'original_cid': self.channel_id,
-            'original_mid': self.message_id,
-            'status':       int(new_status)
-        }, self.base_query)
+        self.handle.table(STATUSES_TABLE_NAME).upsert_by({
+            'status': int(new_status)
+        }, **self.base_fields)
 
     # ...
 
@@ -93,11 +134,11 @@ class Message(LiveDocument):
         :return: Either the alternate or `None` if it is not set.
         :rtype: Optional[Message]
         """
-        query = self.base_query & (where('altype') == int(altype))
-        result = self.handle.table(ALTERNATES_TABLE_NAME).get(query)
+        result = self.handle.table(ALTERNATES_TABLE_NAME).find_one(
+            altype=int(altype), **self.base_fields)
         return None if result is None else \
-            Message(self.handle, channel_id=result['message_cid'],
-                                 message_id=result['message_mid'])
+            self.handle.message(channel_id=result['message_cid'],
+                                message_id=result['message_mid'])
     
     def set_alternate(self, message, altype):
         """Sets the alternate message for an original one i.e., the pending
@@ -122,14 +163,10 @@ class Message(LiveDocument):
         logger.debug('Setting %s for %s/%s to %s/%s', altype, self.channel_id,
             self.message_id, channel_id, message_id)
 
-        query = self.base_query & (where('altype') == int(altype))
-        self.handle.table(ALTERNATES_TABLE_NAME).upsert({
-            'original_cid': self.channel_id,
-            'original_mid': self.message_id,
-            'altype':       int(altype),
+        self.handle.table(ALTERNATES_TABLE_NAME).upsert_by({
             'message_cid':  channel_id,
             'message_mid':  message_id
-        }, query)
+        }, altype=int(altype), **self.base_fields)
     
     # ...
 
@@ -159,16 +196,17 @@ class Message(LiveDocument):
     
     @property
     def original_message(self):
-        query = (where('message_cid') == self.channel_id) & \
-                (where('message_mid') == self.message_id)
-        
-        result = self.handle.table(ALTERNATES_TABLE_NAME).get(query)
-        return Message(self.handle, channel_id=result['original_cid'],
-                                    message_id=result['original_mid'])
+        # An alternate always belongs to the same original, so it is kept.
+        if self._original is None:
+            result = self.handle.table(ALTERNATES_TABLE_NAME).find_one(
+                message_cid=self.channel_id, message_mid=self.message_id)
+            self._original = self.handle.message(
+                channel_id=result['original_cid'],
+                message_id=result['original_mid'])
+        return self._original
 
     async def fetch(self, bot):
-        channel = await bot.fetch_channel(self.channel_id)
-        return await channel.fetch_message(self.message_id)
+        return await bot.fetch_message(self.channel_id, self.message_id)
     
     # ...
 
@@ -187,29 +225,19 @@ class Message(LiveDocument):
         logger.debug('Adding %s/%s as comment hook for %s/%s',
             channel_id, message_id, self.channel_id, self.message_id)
 
-        query = self.base_query                                  & \
-            (where('altype')      == int(AlternateType.COMMENT)) & \
-            (where('message_cid') == channel_id)                 & \
-            (where('message_mid') == message_id)
-        
-        self.handle.table(ALTERNATES_TABLE_NAME).upsert({
-            'original_cid': self.channel_id,
-            'original_mid': self.message_id,
-            'altype':       int(AlternateType.COMMENT),
-            'message_cid':  channel_id,
-            'message_mid':  message_id
-        }, query)
+        self.handle.table(ALTERNATES_TABLE_NAME).upsert_by({},
+            altype=int(AlternateType.COMMENT),
+            message_cid=channel_id,
+            message_mid=message_id,
+            **self.base_fields)
+        self.handle.hooks.add((channel_id, message_id))
     
     @property
     def is_comment_hook(self) -> bool:
         """Checks if this message is a registered comment hook of another
         message. A comment hook is a message that, when replied to, adds a
-        comment onto the original message."""
-        query = (where('message_cid') == self.channel_id) & \
-                (where('message_mid') == self.message_id) & \
-                (where('altype')      == int(AlternateType.COMMENT))
-
-        return self.handle.table(ALTERNATES_TABLE_NAME).get(query) is not None
+        comment onto the original message. This never touches storage."""
+        return (self.channel_id, self.message_id) in self.handle.hooks
 
     # ...
 
@@ -217,6 +245,7 @@ class Message(LiveDocument):
         logger.debug('User %s commented on message %s/%s: %s', user.id,
             self.channel_id, self.message_id, content)
         
+        seq = self.handle.sequence.next()
         self.handle.table(COMMENTS_TABLE_NAME).insert({
             'original_cid': self.channel_id,
             'original_mid': self.message_id,
@@ -225,14 +254,21 @@ class Message(LiveDocument):
                 'name': user.name,
                 'discriminator': user.discriminator
             },
-            'content':      content
+            'content':      content,
+            'seq':          seq
         })
+
+        # Incremental exports pick up the message along with its comments.
+        self.handle.table(MESSAGES_TABLE_NAME).upsert_by({
+            'seq': seq
+        }, **self.base_fields)
     
     # ...
 
     @property
     def comments(self) -> Generator[dict, None, None]:
-        results = self.handle.table(COMMENTS_TABLE_NAME).search(self.base_query)
+        table = self.handle.table(COMMENTS_TABLE_NAME)
+        results = table.find(**self.base_fields)
         for document in results:
             # Yields elements that look like:
             # {
@@ -251,13 +287,10 @@ class Message(LiveDocument):
 
     # ...
 
-    async def add_to_database(self, bot, anonymize=False):
+    def save_message(self, message, anonymize=False):
         logger.debug('Adding %s/%s to database',
             self.channel_id, self.message_id)
 
-        # Fetch the actual message.
-        message = await self.fetch(bot)
-
         doc = {
             'original_cid': self.channel_id,
             'original_mid': self.message_id,
@@ -286,7 +319,9 @@ class Message(LiveDocument):
                 'id':            message.author.id
             }
         
-        self.handle.table(MESSAGES_TABLE_NAME).upsert(doc, self.base_query)
+        doc['seq'] = self.handle.sequence.next()
+        self.handle.table(MESSAGES_TABLE_NAME).upsert_by(doc,
+            **self.base_fields)
     
     def add_metadata(self, metadata):
         result = self.get_metadata()
@@ -297,66 +332,157 @@ class Message(LiveDocument):
         logger.debug('Setting metadata of %s/%s to %s',
             self.channel_id, self.message_id, metadata)
 
-        self.handle.table(MESSAGES_TABLE_NAME).upsert({
-            'original_cid': self.channel_id,
-            'original_mid': self.message_id,
-            'metadata':     metadata
-        }, self.base_query)
+        self.handle.table(MESSAGES_TABLE_NAME).upsert_by({
+            'metadata': metadata,
+            'seq':      self.handle.sequence.next()
+        }, **self.base_fields)
     
     def get_metadata(self) -> dict:
-        result = self.handle.table(MESSAGES_TABLE_NAME).get(self.base_query)
+        table = self.handle.table(MESSAGES_TABLE_NAME)
+        result = table.find_one(**self.base_fields)
         return {} if result is None else result.get('metadata', {})
 
+class MessageRecord:
+    """Everything that is stored about an original message, as read by
+    `Database.load_message`. Changes stay on the record until `flush` writes
+    them all at once, so a handler can check and change several fields for
+    the price of one read and one write.
+
+    Example:
+
+        `record = db.load_message(message)`
+    """
+    __slots__ = ('message', 'comment_count', '_status', '_alternates',
+                 '_metadata', '_dirty')
+
+    def __init__(self, message, status, alternates, metadata, comment_count):
+        self.message = message
+        self.comment_count = comment_count
+        self._status = status
+        # Maps alternate types onto `(channel_id, message_id)`.
+        self._alternates = alternates
+        self._metadata = metadata
+        self._dirty = set()
+
+    @property
+    def channel_id(self) -> int:
+        return self.message.channel_id
+
+    @property
+    def message_id(self) -> int:
+        return self.message.message_id
+
+    @property
+    def status(self) -> Optional[MessageStatus]:
+        return self._status
+
+    @status.setter
+    def status(self, new_status):
+        self._status = MessageStatus(new_status)
+        self._dirty.add('status')
+
+    @property
+    def metadata(self) -> dict:
+        return self._metadata
+
+    def add_metadata(self, metadata):
+        self._metadata = {**self._metadata, **metadata}
+        self._dirty.add('metadata')
+
+    def get_alternate(self, altype) -> Optional[Message]:
+        ids = self._alternates.get(AlternateType(altype))
+        return None if ids is None else self.message.handle.message(
+            channel_id=ids[0], message_id=ids[1])
+
+    def set_alternate(self, message, altype):
+        # Turns either kind of message into ids.
+        message = self.message.handle.message(message)
+        self._alternates[AlternateType(altype)] = \
+            (message.channel_id, message.message_id)
+        self._dirty.add(AlternateType(altype))
+
+    @property
+    def pending_message(self) -> Optional[Message]:
+        return self.get_alternate(AlternateType.PENDING)
+
+    @property
+    def request_message(self) -> Optional[Message]:
+        return self.get_alternate(AlternateType.REQUEST)
+
+    @property
+    def approved_message(self) -> Optional[Message]:
+        return self.get_alternate(AlternateType.APPROVED)
+
+    def flush(self):
+        """Writes every changed field in one transaction. This must be called
+        on the database thread."""
+        if not self._dirty:
+            return
+
+        with self.message.handle.transaction():
+            for field in self._dirty:
+                if field == 'status':
+                    self.message.status = self._status
+                elif field == 'metadata':
+                    self.message.set_metadata(self._metadata)
+                else: # An alternate.
+                    self.message.set_alternate(self.get_alternate(field),
+                        field)
+
+        self._dirty.clear()
+
 class Channel(LiveDocument):
+    __slots__ = ('id',)
+
     def __init__(self, handle, channel=None, id=0):
         self.handle = handle
-        self.id = id
+        self.id, = Channel.identify(channel, id)
 
-        if channel is not None:
-            self.id = channel.id
+    @staticmethod
+    def identify(channel=None, id=0) -> tuple:
+        return (id if channel is None else channel.id,)
     
     @property
-    def base_query(self) -> Query:
-        return where('channel_id') == self.id
+    def base_fields(self) -> dict:
+        return {'channel_id': self.id}
     
     async def fetch(self, bot):
         return await bot.fetch_channel(self.id)
 
     @property
     def group(self) -> Optional[str]:
-        document = self.handle.table(BRIDGES_TABLE_NAME).get(self.base_query)
-        return None if document is None else document.get('group', None)
+        return self.handle.routes.group_of(self.id)
     
     @group.setter
     def group(self, value):
         logger.debug('Group for %s set to %s', self.id, value)
 
-        self.handle.table(BRIDGES_TABLE_NAME).upsert({
-            'channel_id': self.id,
+        self.handle.table(BRIDGES_TABLE_NAME).upsert_by({
             'group': value
-        }, self.base_query)
+        }, **self.base_fields)
+        self.handle.routes.assign(self.id, value)
     
     @group.deleter
     def group(self):
         logger.debug('Group for %s removed', self.id)
 
-        query = where('channel_id') == self.id
-        self.handle.table(BRIDGES_TABLE_NAME).remove(query)
+        self.handle.table(BRIDGES_TABLE_NAME).remove_by(**self.base_fields)
+        self.handle.routes.discard(self.id)
     
     def get_channels_in_group(self, group) -> Generator['Channel', None, None]:
-        query = where('group') == group
-        results = self.handle.table(BRIDGES_TABLE_NAME).search(query)
-
-        for document in results:
-            yield Channel(self.handle, id=document['channel_id'])
+        for channel_id in self.handle.routes.channels_in(group):
+            yield self.handle.channel(id=channel_id)
 
 class Guild(LiveDocument):
+    __slots__ = ('id',)
+
     def __init__(self, handle, guild=None, id=0):
         self.handle = handle
-        self.id = id
+        self.id, = Guild.identify(guild, id)
 
-        if guild is not None:
-            self.id = guild.id
+    @staticmethod
+    def identify(guild=None, id=0) -> tuple:
+        return (id if guild is None else guild.id,)
 
     class ChannelType(IntEnum):
         PENDING = 0
@@ -364,24 +490,22 @@ class Guild(LiveDocument):
         BRIDGE = 2
 
     @property
-    def base_query(self):
-        return where('guild_id') == self.id
+    def base_fields(self) -> dict:
+        return {'guild_id': self.id}
 
     def set_channel(self, channel, type):
         logger.debug('Channel (%s) for %s set to %s', type, self.id,
             channel.id)
 
-        self.handle.table(CHANNELS_TABLE_NAME).upsert({
-            'guild_id': self.id,
-            'type': int(type),
+        self.handle.table(CHANNELS_TABLE_NAME).upsert_by({
             'channel_id': channel.id
-        }, self.base_query & (where('type') == int(type)))
+        }, type=int(type), **self.base_fields)
     
     def get_channel(self, type):
-        query = self.base_query & (where('type') == int(type))
-        result = self.handle.table(CHANNELS_TABLE_NAME).get(query)
+        result = self.handle.table(CHANNELS_TABLE_NAME).find_one(
+            type=int(type), **self.base_fields)
         return None if result is None else \
-            Channel(self.handle, id=result['channel_id'])
+            self.handle.channel(id=result['channel_id'])
 
     # ...
 
@@ -410,15 +534,18 @@ class Guild(LiveDocument):
         self.set_channel(new_channel, Guild.ChannelType.BRIDGE)
 
 class User(LiveDocument):
+    __slots__ = ('id',)
+
     def __init__(self, handle, user=None, id=0):
         self.handle = handle
-        self.id = id
+        self.id, = User.identify(user, id)
 
-        if user is not None:
-            self.id = user.id
+    @staticmethod
+    def identify(user=None, id=0) -> tuple:
+        return (id if user is None else user.id,)
     
     @property
-    def base_query(self) -> Query:
+    def base_fields(self) -> dict:
         # We will be accessing by `doc_id`, so we don't need this.
         raise NotImplementedError()
 
@@ -448,12 +575,243 @@ class User(LiveDocument):
             'is_admin': new_status
         }, doc_id=self.id))
 
+    @property
+    def export_cursor(self) -> Optional[int]:
+        """The sequence number that this user's last export went up to."""
+        result = self.handle.table(USERS_TABLE_NAME).get(doc_id=self.id)
+        return None if result is None else result.get('export_cursor')
+    
+    @export_cursor.setter
+    def export_cursor(self, new_cursor):
+        logger.debug('Setting `export_cursor` for %s to %s', self.id,
+            new_cursor)
+
+        self.handle.table(USERS_TABLE_NAME).upsert(Document({
+            'export_cursor': new_cursor
+        }, doc_id=self.id))
+
+class Sequence:
+    """Hands out increasing numbers that are stamped onto messages and
+    comments whenever they are written, so that exports can ask for whatever
+    changed after a given number."""
+    def __init__(self, start=0):
+        self.value = start
+        self._lock = threading.Lock()
+
+    def next(self) -> int:
+        with self._lock:
+            self.value += 1
+            return self.value
+
+class BridgeRoutes:
+    """Maps channels onto their bridge group and groups onto their channels.
+    It is loaded from the bridges table once and then kept up to date by
+    `Channel.group`, so routing a message never touches storage.
+
+    Writes happen on the database thread while reads happen on the event loop,
+    which is why the sets of channels are replaced rather than changed."""
+    def __init__(self, table):
+        self._groups = {}
+        self._channels = {}
+
+        for document in table.all():
+            self.assign(document['channel_id'], document['group'])
+        
+        logger.info('Loaded %s bridged channels', len(self._groups))
+
+    def group_of(self, channel_id) -> Optional[str]:
+        return self._groups.get(channel_id)
+
+    def channels_in(self, group) -> frozenset:
+        return self._channels.get(group, frozenset())
+
+    def assign(self, channel_id, group):
+        self.discard(channel_id)
+        self._groups[channel_id] = group
+        self._channels[group] = self.channels_in(group) | {channel_id}
+
+    def discard(self, channel_id):
+        group = self._groups.pop(channel_id, None)
+        if group is not None:
+            remaining = self.channels_in(group) - {channel_id}
+            if remaining:
+                self._channels[group] = remaining
+            else:
+                self._channels.pop(group, None)
+
+class CodePool:
+    """The compensation codes that are handed out to curators. Codes are kept
+    once claimed, so the unclaimed ones are queued by id and every code is kept
+    in a set. Both are loaded from the compensation table once, so popping and
+    deduplicating codes never read more than the one document.
+
+    Only the database thread changes the pool, `remaining` can be read from
+    anywhere."""
+    def __init__(self, table):
+        self.table = table
+        self.codes = set()
+        self._unclaimed = deque()
+
+        for document in table.all():
+            self.codes.add(document['code'])
+            # Codes from before claiming existed were removed when they were
+            # handed out, so any that are left have not been claimed.
+            if not document.get('claimed', False):
+                self._unclaimed.append(document.doc_id)
+
+        logger.info('Loaded %s compensation codes, %s unclaimed',
+            len(self.codes), self.remaining)
+
+    @property
+    def remaining(self) -> int:
+        return len(self._unclaimed)
+
+    def add(self, codes) -> Tuple[int, int]:
+        """Adds every code that is not already in the pool with one write.
+
+        :param codes: Any codes, repeats are fine.
+        :type codes: Iterable[str]
+        :return: How many codes were added and how many were duplicates.
+        :rtype: Tuple[int, int]
+        """
+        fresh = {}
+        duplicates = 0
+        for code in codes:
+            if code in self.codes or code in fresh:
+                duplicates += 1
+            else:
+                fresh[code] = None
+
+        doc_ids = self.table.insert_multiple([{'code': code, 'claimed': False}
+            for code in fresh])
+        self.codes.update(fresh)
+        self._unclaimed.extend(doc_ids)
+        return len(fresh), duplicates
+
+    def pop(self, claimed_by=None) -> Optional[str]:
+        """Claims the oldest unclaimed code.
+
+        :param claimed_by: The id of the user that the code is for.
+        :type claimed_by: Optional[int]
+        :return: The code or `None` if every code has been claimed.
+        :rtype: Optional[str]
+        """
+        if not self._unclaimed:
+            return None
+
+        doc_id = self._unclaimed.popleft()
+        self.table.update({
+            'claimed':    True,
+            'claimed_by': claimed_by,
+            'claimed_at': datetime.utcnow().isoformat()
+        }, doc_ids=[doc_id])
+        return self.table.get(doc_id=doc_id)['code']
+
 class Database:
-    def __init__(self, filename):
-        self.handle = TinyDB(filename, indent=4)
+    def __init__(self, filename, engine=DATABASE_ENGINE):
+        self.handle = open_storage(engine, filename, INDEXES)
 
         logger.info('Opening %s as database', filename)
-    
+
+        # Live documents are shared while anything is using them.
+        self.documents = weakref.WeakValueDictionary()
+        self._documents_lock = threading.Lock()
+        self._recent = deque(maxlen=LIVE_DOCUMENTS_KEPT)
+
+        # Loaded before the database thread starts using the storage.
+        self.load_memory()
+        self.sequence = Sequence(max(
+            self.table(MESSAGES_TABLE_NAME).last_value('seq') or 0,
+            self.table(COMMENTS_TABLE_NAME).last_value('seq') or 0))
+        self.load_curators()
+        self._depth = 0
+
+    def table(self, name):
+        return self.handle.table(name)
+
+    def load_memory(self):
+        # Everything that is kept in memory alongside the storage.
+        self.routes = BridgeRoutes(self.table(BRIDGES_TABLE_NAME))
+        self.hooks = self.load_comment_hooks()
+        self.codes = CodePool(self.table(COMPENSATION_TABLE_NAME))
+
+    @contextmanager
+    def transaction(self):
+        """Groups writes so that they are stored together in one write, or not
+        at all if an exception is raised. Nested transactions are part of the
+        outermost one.
+
+        Example:
+
+            `with db.transaction():`
+        """
+        self._depth += 1
+        try:
+            with self.handle.transaction():
+                yield
+        except BaseException:
+            # What is in memory may have seen writes that were just undone.
+            if self._depth == 1:
+                self.load_memory()
+            raise
+        finally:
+            self._depth -= 1
+
+    def sync(self):
+        """Waits until every write so far is on disk. Only the journal engine
+        holds on to writes, the others have already written them."""
+        sync = getattr(self.handle, 'sync', None)
+        if sync is not None:
+            sync()
+
+    def load_comment_hooks(self) -> set:
+        """Loads the `(channel_id, message_id)` of every comment hook. Replies
+        to anything else are rejected with a set lookup."""
+        results = self.table(ALTERNATES_TABLE_NAME).find(
+            altype=int(AlternateType.COMMENT))
+        hooks = {(doc['message_cid'], doc['message_mid']) for doc in results}
+
+        logger.info('Loaded %s comment hooks', len(hooks))
+        return hooks
+    
+    def load_message(self, *args, **kwargs) -> MessageRecord:
+        """Reads the status, alternates, metadata and number of comments of an
+        original message. Each comes from an index on the original's ids.
+        Takes the same arguments as `message`.
+
+        :rtype: MessageRecord
+        """
+        message = self.message(*args, **kwargs)
+        fields = message.base_fields
+
+        status = self.table(STATUSES_TABLE_NAME).find_one(**fields)
+        alternates = {AlternateType(doc['altype']):
+            (doc['message_cid'], doc['message_mid'])
+            for doc in self.table(ALTERNATES_TABLE_NAME).find(**fields)
+            if doc['altype'] != AlternateType.COMMENT}
+        document = self.table(MESSAGES_TABLE_NAME).find_one(**fields)
+        comment_count = len(self.table(COMMENTS_TABLE_NAME).find_ids(
+            **fields))
+
+        return MessageRecord(message,
+            None if status is None else MessageStatus(status['status']),
+            alternates, {} if document is None else
+            document.get('metadata', {}), comment_count)
+
+    def document(self, kind, *args, **kwargs) -> LiveDocument:
+        """Gets the live document of type `kind` with the given ids, reusing
+        the existing one if it is still around."""
+        key = (kind, *kind.identify(*args, **kwargs))
+        with self._documents_lock:
+            document = self.documents.get(key)
+            if document is None:
+                document = kind(self, *args, **kwargs)
+                self.documents[key] = document
+
+            # Keeps the most recent ones alive between handlers.
+            self._recent.append(document)
+        return document
+
     def message(self, *args, **kwargs) -> Message:
         """Gets the live document referring to a message from the database.
 
@@ -466,7 +824,7 @@ class Database:
         :return: A live document referring to a specific message.
         :rtype: Message
         """
-        return Message(self.handle, *args, **kwargs)
+        return self.document(Message, *args, **kwargs)
     
     def guild(self, *args, **kwargs) -> Guild:
         """Gets the live document referring to a guild from the database.
@@ -480,7 +838,7 @@ class Database:
         :return: A live document referring to a specific guild.
         :rtype: Guild
         """
-        return Guild(self.handle, *args, **kwargs)
+        return self.document(Guild, *args, **kwargs)
     
     def user(self, *args, **kwargs) -> User:
         """Gets the live document referring to a user from the database.
@@ -492,45 +850,143 @@ class Database:
         :return: A live document referring to a specific user.
         :rtype: User
         """
-        return User(self.handle, *args, **kwargs)
+        return self.document(User, *args, **kwargs)
     
     def channel(self, *args, **kwargs) -> Channel:
-        return Channel(self.handle, *args, **kwargs)
-    
-    # inserts new codes
-    def insert_compensation_codes(self, codes):
-        table = self.handle.table('compensation')
+        return self.document(Channel, *args, **kwargs)
+    
+    def insert_compensation_codes(self, codes) -> Tuple[int, int]:
+        return self.codes.add(codes)
+
+    def pop_compensation_code(self, claimed_by=None) -> Optional[str]:
+        return self.codes.pop(claimed_by)
+
+    def load_curators(self):
+        """Builds the curators table from the messages table the first time
+        round. From then on, `record_curation` keeps it up to date."""
+        table = self.table(CURATORS_TABLE_NAME)
+        if len(table) > 0:
+            return
+
+        curators = {}
+        for document in self.table(MESSAGES_TABLE_NAME):
+            metadata = document.get('metadata', {})
+            curator = metadata.get('curated_by')
+            if curator is None:
+                continue
+
+            when = metadata.get('curated_at')
+            current = curators.setdefault(curator['id'], {
+                'user_id':       curator['id'],
+                'name':          curator.get('name'),
+                'discriminator': curator.get('discriminator'),
+                'count':         0,
+                'first_at':      when,
+                'last_at':       when
+            })
+            current['count'] += 1
+            if when is not None:
+                current['first_at'] = min(current['first_at'] or when, when)
+                current['last_at'] = max(current['last_at'] or when, when)
+
+        table.insert_multiple(list(curators.values()))
+        logger.info('Indexed %s curators', len(curators))
+
+    def record_curation(self, user, when):
+        """Counts a curation towards `user`.
+
+        :param user: Whoever curated the message.
+        :type user: discord.User
+        :param when: When it was curated in ISO format.
+        :type when: str
+        """
+        table = self.table(CURATORS_TABLE_NAME)
+        current = table.find_one(user_id=user.id)
+        fields = {
+            'name':          user.name,
+            'discriminator': user.discriminator,
+            'last_at':       when
+        }
 
-        for code in codes:
-            table.insert({'code': code})
-
-    # removes a code from the list
-    def pop_compensation_code(self):
-        table = self.handle.table('compensation')
-
-        max_code = len(table.all())
-        code = table.get(doc_id=max_code)
-        table.remove(doc_ids=[max_code])
-
-        return code['code']
-    
-    async def get_all_curators(self, bot):
-        results = self.handle.table(MESSAGES_TABLE_NAME).search(
-            where('metadata').curated_by.exists()
-        )
-      
-        user_ids = set()
-        for result in results:
-            user_id = result['metadata']['curated_by']['id']
-            user_ids.add(user_id)
-        
-        for user_id in user_ids:
-            yield await bot.fetch_user(user_id)
+        if current is None:
+            table.insert({'user_id': user.id, 'count': 1, 'first_at': when,
+                **fields})
+        else:
+            table.update({'count': current['count'] + 1, **fields},
+                doc_ids=[current.doc_id])
+
+    def get_curators(self) -> List[Document]:
+        """Gets every curator, the most active first."""
+        return sorted(self.table(CURATORS_TABLE_NAME),
+            key=lambda curator: curator['count'], reverse=True)
+
+    def get_curator_ids(self) -> set:
+        return {curator['user_id']
+            for curator in self.table(CURATORS_TABLE_NAME)}
+
+def _resolve_future(future, result=None, error=None):
+    # Runs on the event loop, the caller may have given up on it.
+    if future.cancelled():
+        return
+
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+
+class AsyncDatabase:
+    """Runs calls against a `Database` on a dedicated thread so that the event
+    loop never blocks on disk. Calls are queued and run one at a time in the
+    order that they were made, so a read always sees earlier writes.
+
+    Examples:
+
+        `status = await adb.read(lambda: db.message(message).status)`
+
+        `await adb.write(setattr, db.user(ctx.author), 'is_admin', True)`
+    """
+    def __init__(self, database):
+        self.database = database
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='database',
+            daemon=True)
+        self._thread.start()
+
+    @property
+    def pending(self) -> int:
+        """The number of calls that are waiting to run."""
+        return self._queue.qsize()
+
+    def _run(self):
+        while True:
+            loop, future, function, args, kwargs = self._queue.get()
+            try:
+                result = function(*args, **kwargs)
+            except Exception as error:
+                loop.call_soon_threadsafe(_resolve_future, future, None, error)
+            else:
+                loop.call_soon_threadsafe(_resolve_future, future, result)
+
+    def _submit(self, function, args, kwargs) -> asyncio.Future:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._queue.put((loop, future, function, args, kwargs))
+        return future
+
+    async def read(self, function, *args, **kwargs):
+        """Calls `function` on the database thread and returns its result."""
+        return await self._submit(function, args, kwargs)
+
+    async def write(self, function, *args, **kwargs):
+        """Calls `function` on the database thread and waits until it (and
+        every call before it) has been applied."""
+        return await self._submit(function, args, kwargs)
 
 # Accessible in other modules.
 db = Database(DATABASE_FNAME)
+adb = AsyncDatabase(db)
 
-def is_admin(ctx) -> bool:
+async def is_admin(ctx) -> bool:
     """Checks whether or not the given context is from an admin.
 
     :param ctx: Any command context.
@@ -538,4 +994,4 @@ def is_admin(ctx) -> bool:
     :return: Whether or not `ctx.author` is an admin.
     :rtype: bool
     """
-    return db.user(ctx.author).is_admin
+    return await adb.read(lambda: db.user(ctx.author).is_admin)
@@ -0,0 +1,235 @@
+from database import MESSAGES_TABLE_NAME, STATUSES_TABLE_NAME, \
+    MessageStatus, adb, db
+from typing import List
+from pathlib import Path
+from constants import *
+import asyncio
+import logging
+import gzip
+import json
+
+logger = logging.getLogger(__name__)
+
+EXPORT_FORMATS = ('json', 'ndjson')
+
+class PartWriter:
+    """Writes documents to gzip-compressed files as they arrive, starting a
+    new part whenever the current one reaches `limit` bytes on disk. Each part
+    can be read on its own i.e., JSON parts are complete arrays.
+
+    Example:
+
+        `writer = PartWriter(Path('exports/today'), 'ndjson')`
+    """
+    def __init__(self, stem, format='json', limit=EXPORT_PART_SIZE):
+        if format not in EXPORT_FORMATS:
+            raise ValueError(f'Unknown export format {format!r}')
+
+        self.stem = stem
+        self.format = format
+        self.limit = limit
+        self.parts: List[Path] = []
+        self._raw = None
+        self._file = None
+        self._count = 0
+
+    def _open(self):
+        path = Path(f'{self.stem}.part{len(self.parts) + 1}.{self.format}.gz')
+        self._raw = open(path, 'wb')
+        self._file = gzip.GzipFile(fileobj=self._raw, mode='wb')
+        self._count = 0
+        self.parts.append(path)
+
+        if self.format == 'json':
+            self._file.write(b'[')
+
+    def _close_part(self):
+        if self.format == 'json':
+            self._file.write(b'\n]\n')
+
+        self._file.close()
+        self._raw.close()
+        self._file = None
+
+    def write(self, document):
+        if self._file is None:
+            self._open()
+        elif self._raw.tell() >= self.limit:
+            self._close_part()
+            self._open()
+
+        text = json.dumps(document)
+        if self.format == 'json':
+            text = ('\n' if self._count == 0 else ',\n') + text
+        else: # Newline-delimited.
+            text = text + '\n'
+
+        self._file.write(text.encode('utf-8'))
+        self._count += 1
+
+    def write_many(self, documents):
+        for document in documents:
+            self.write(document)
+
+    def close(self) -> List[Path]:
+        # Always produce at least one (empty) part.
+        if self._file is None and not self.parts:
+            self._open()
+
+        if self._file is not None:
+            self._close_part()
+
+        return self.parts
+
+def attach_comments(documents) -> list:
+    # Comments are found through the index on their original message, so this
+    # does not scan the comments table once per message.
+    for document in documents:
+        message = db.message(
+            channel_id=document.get('original_cid'),
+            message_id=document.get('original_mid')
+        )
+
+        comments = document.get('comments', [])
+        comments.extend(message.comments)
+        document['comments'] = comments
+
+    return documents
+
+def export_page(after, limit=EXPORT_PAGE_SIZE) -> list:
+    """Gets the next page of messages with their comments attached.
+
+    :param after: The id of the last message in the previous page.
+    :type after: int
+    :param limit: The number of messages in this page.
+    :type limit: int
+    :return: Messages in order of id.
+    :rtype: List[Document]
+    """
+    documents = db.table(MESSAGES_TABLE_NAME).page(after, limit)
+    return attach_comments(documents)
+
+class Selection:
+    """Which messages to export. Every condition is answered by an index, so
+    narrowing an export to one guild only touches that guild's messages.
+
+    Example:
+
+        `selection = Selection(guild__id=1234, status=MessageStatus.APPROVED)`
+    """
+    def __init__(self, status: MessageStatus=None, **equal):
+        # Fields that must equal a value e.g., `channel__id`.
+        self.equal = equal
+        # Maps sorted fields onto inclusive `(low, high)` bounds.
+        self.ranges = {}
+        self.status = status
+
+    def between(self, field, low=None, high=None) -> 'Selection':
+        self.ranges[field] = (low, high)
+        return self
+
+    @property
+    def everything(self) -> bool:
+        return not (self.equal or self.ranges or self.status is not None)
+
+    def ids(self) -> List[int]:
+        """Finds the ids of every selected message. This must be called on the
+        database thread.
+
+        :return: The ids of the messages in order.
+        :rtype: List[int]
+        """
+        table = db.table(MESSAGES_TABLE_NAME)
+        selected = None
+
+        def narrow(doc_ids):
+            nonlocal selected
+            doc_ids = set(doc_ids)
+            selected = doc_ids if selected is None else selected & doc_ids
+
+        if self.equal:
+            narrow(table.find_ids(**self.equal))
+
+        for field, (low, high) in self.ranges.items():
+            if selected is not None and not selected:
+                break
+            narrow(table.range_ids(field, low, high))
+
+        statuses = db.table(STATUSES_TABLE_NAME)
+        if self.status is not None and selected is None:
+            narrow(doc_id for status in statuses.find(status=int(self.status))
+                for doc_id in table.find_ids(
+                    original_cid=status['original_cid'],
+                    original_mid=status['original_mid']))
+        elif self.status is not None and selected:
+            # Only the messages selected so far are checked, each through the
+            # index on their original message.
+            def has_status(doc_id) -> bool:
+                message = table.get(doc_id=doc_id)
+                return bool(statuses.find_ids(
+                    original_cid=message.get('original_cid'),
+                    original_mid=message.get('original_mid'),
+                    status=int(self.status)))
+
+            selected = set(filter(has_status, selected))
+
+        return sorted(table.find_ids() if selected is None else selected)
+
+def selected_page(doc_ids) -> list:
+    """Gets the messages with the given ids with their comments attached.
+
+    :param doc_ids: The ids of the messages in this page.
+    :type doc_ids: List[int]
+    :rtype: List[Document]
+    """
+    table = db.table(MESSAGES_TABLE_NAME)
+    documents = [table.get(doc_id=doc_id) for doc_id in doc_ids]
+    return attach_comments([d for d in documents if d is not None])
+
+async def read_pages(selection=None):
+    """Yields the selected messages a page at a time, reading each page in
+    its own database call.
+
+    :param selection: Only read these messages, defaults to all of them.
+    :type selection: Optional[Selection]
+    """
+    if selection is None or selection.everything:
+        after = 0
+        while True:
+            documents = await adb.read(export_page, after)
+            if not documents:
+                return
+            yield documents
+            after = documents[-1].doc_id
+    else: # Filtered exports work out which ids they want up front.
+        doc_ids = await adb.read(selection.ids)
+        for start in range(0, len(doc_ids), EXPORT_PAGE_SIZE):
+            yield await adb.read(selected_page,
+                doc_ids[start:start + EXPORT_PAGE_SIZE])
+
+async def export_messages(stem, format='json', selection=None) -> List[Path]:
+    """Exports messages to gzip-compressed parts that start with `stem`.
+    Messages are read a page at a time and written as they arrive, so memory
+    stays flat and other database calls can run in between pages.
+
+    :param stem: The path of the parts without any suffixes.
+    :type stem: Path
+    :param format: Either 'json' or 'ndjson', defaults to 'json'.
+    :type format: str
+    :param selection: Only export these messages, defaults to all of them.
+    :type selection: Optional[Selection]
+    :return: The paths to the parts.
+    :rtype: List[Path]
+    """
+    loop = asyncio.get_running_loop()
+    writer = PartWriter(stem, format)
+
+    exported = 0
+    async for documents in read_pages(selection):
+        # Compressing is too slow to do on the event loop.
+        await loop.run_in_executor(None, writer.write_many, documents)
+        exported += len(documents)
+
+    parts = await loop.run_in_executor(None, writer.close)
+    logger.info('Exported %s messages to %s part(s)', exported, len(parts))
+    return parts
@@ -2,6 +2,8 @@ from discord_slash.utils.manage_components import *
 from discord_slash.model import ButtonStyle
 from discord.ext import commands
 from hashlib import shake_128
+from cache import LRUCache
+from outbound import Priority, outbound
 from constants import *
 import logging
 import discord
@@ -17,6 +19,9 @@ YES_CUSTOM_ID = 'yes'
 YES_ANONYMOUSLY_CUSTOM_ID = 'yes_anonymously'
 NO_CUSTOM_ID = 'no'
 
+# Rendered embeds as dictionaries, see `message_to_embed`.
+embed_cache = LRUCache(EMBED_CACHE_SIZE)
+
 def init_logging() -> None:
     logging.basicConfig(level=logging.DEBUG)
 
@@ -45,7 +50,7 @@ def get_emoji(bot, message) -> str:
     :return: An emoji.
     :rtype: str
     """
-    return '🔭'
+    return CURATION_EMOJI
 
 def user_to_hash(user_id) -> str:
     """Gets the pseudo-unique identifier for a given user.
@@ -75,8 +80,18 @@ def user_to_color(user) -> int:
     """
     return int(int(user.discriminator) / 9999 * 0xffffff)
 
+def copy_embed_dict(data) -> dict:
+    # `discord.Embed.from_dict` keeps the nested dictionaries and lists that
+    # it is given, so they are copied to keep callers from changing ours.
+    return {key: [dict(field) for field in value] if key == 'fields' else
+        dict(value) if isinstance(value, dict) else value
+        for key, value in data.items()}
+
 def message_to_embed(message, anonymize=False) -> discord.Embed:
-    """Turns a message into a embed as if it is being quoted.
+    """Turns a message into a embed as if it is being quoted. The same message
+    is quoted many times e.g., pending, request and approved, so rendered
+    embeds are kept in `embed_cache` until the message is edited. Callers get
+    their own copy which they are free to add to.
 
     :param message: Any message.
     :type message: discord.Message
@@ -85,6 +100,14 @@ def message_to_embed(message, anonymize=False) -> discord.Embed:
     :return: An embed.
     :rtype: discord.Embed
     """
+    key = (message.channel.id, message.id, message.edited_at, anonymize)
+    data = embed_cache.get(key)
+    if data is None:
+        data = render_embed(message, anonymize).to_dict()
+        embed_cache.put(key, data)
+    return discord.Embed.from_dict(copy_embed_dict(data))
+
+def render_embed(message, anonymize=False) -> discord.Embed:
     embed = discord.Embed(
         description=message.content,
         timestamp=message.edited_at or message.created_at,
@@ -147,7 +170,7 @@ async def disable_pending_action_row(pending):
     :type pending: discord.Message
     """
     row = make_pending_action_row(disabled=True)
-    await pending.edit(components=[row])
+    await outbound.edit(pending, Priority.INTERACTION, components=[row])
 
 def make_request_action_row(disabled=False) -> dict:
     """Makes the action row for the request message. The action row contains
@@ -196,7 +219,7 @@ async def disable_request_action_row(request):
     :type request: discord.Message
     """
     row = make_request_action_row(disabled=True)
-    await request.edit(components=[row])
+    await outbound.edit(request, Priority.INTERACTION, components=[row])
 
 def add_consent_message(embed) -> discord.Embed:
     """Adds the consent message onto an embed as a field.
@@ -241,7 +264,7 @@ async def send_introduction(user, guild):
 
     logger.debug('Sending introduction to %s from %s', user.id, guild.id)
 
-    await user.send(embed=embed)
+    await outbound.send(user, Priority.CONSENT, embed=embed)
 
 def add_introduction_field(embed, guild):
     link = ('https://www.rmit.edu.au/research/centres-collaborations/derc/'
@@ -281,7 +304,8 @@ async def send_thanks(user, responded_yes, guild):
     logger.debug('Thanking %s for %s from %s', user.id,
         'responding yes' if responded_yes else 'responding no', guild.id)
 
-    await user.send(content=text_yes if responded_yes else text_no)
+    await outbound.send(user, Priority.CONSENT,
+        content=text_yes if responded_yes else text_no)
 
 async def notify_observer(observer, subject):
     """Notifies `observer` that `subject` just gave consent to use their post
@@ -298,7 +322,7 @@ async def notify_observer(observer, subject):
 
     logger.debug('Notifying observer %s about %s', observer.id, subject.id)
 
-    await observer.send(content=text)
+    await outbound.send(observer, Priority.CURATION, content=text)
 
 def add_commentable_message(embed):
     embed.add_field(
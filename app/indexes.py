@@ -0,0 +1,390 @@
+from tinydb.middlewares import Middleware
+from tinydb.table import Document, Table
+from tinydb.storages import JSONStorage
+from typing import Dict, Iterable, List, Optional, Tuple
+from contextlib import contextmanager
+from tinydb import TinyDB
+import bisect
+import copy
+import logging
+
+logger = logging.getLogger(__name__)
+
+def resolve(document, field):
+    """Gets the value of `field` from `document`. Nested fields are written
+    with double underscores i.e., `guild__id` is `document['guild']['id']`.
+
+    :param document: Any document.
+    :type document: dict
+    :param field: The name of the field.
+    :type field: str
+    :return: The value or `None` if it is missing.
+    :rtype: Any
+    """
+    for part in field.split('__'):
+        if not isinstance(document, dict):
+            return None
+        document = document.get(part)
+    return document
+
+class HashIndex:
+    """Maps the values of one or more fields onto the ids of the documents
+    that have those values."""
+    def __init__(self, fields):
+        self.fields = tuple(fields)
+        self._buckets = {}
+
+    def key(self, document) -> tuple:
+        return tuple(resolve(document, field) for field in self.fields)
+
+    def add(self, doc_id, document):
+        self._buckets.setdefault(self.key(document), set()).add(doc_id)
+
+    def discard(self, doc_id, document):
+        key = self.key(document)
+        bucket = self._buckets.get(key)
+        if bucket is not None:
+            bucket.discard(doc_id)
+            if not bucket:
+                del self._buckets[key]
+
+    def lookup(self, key) -> set:
+        return self._buckets.get(key, set())
+
+    def clear(self):
+        self._buckets.clear()
+
+class SortedIndex:
+    """Keeps the ids of documents ordered by the value of one field, so that
+    ranges of values can be found without a scan. Documents without the field
+    are left out."""
+    def __init__(self, field):
+        self.field = field
+        self._entries = []
+
+    def add(self, doc_id, document):
+        value = resolve(document, self.field)
+        if value is not None:
+            bisect.insort(self._entries, (value, doc_id))
+
+    def discard(self, doc_id, document):
+        value = resolve(document, self.field)
+        if value is not None:
+            position = bisect.bisect_left(self._entries, (value, doc_id))
+            if self._entries[position:position + 1] == [(value, doc_id)]:
+                del self._entries[position]
+
+    def range(self, low=None, high=None, limit=None) -> List[int]:
+        start = 0 if low is None else \
+            bisect.bisect_left(self._entries, (low,))
+        stop = len(self._entries) if high is None else \
+            bisect.bisect_right(self._entries, (high, float('inf')))
+        if limit is not None:
+            stop = min(stop, start + limit)
+        return [doc_id for _, doc_id in self._entries[start:stop]]
+
+    def last_value(self):
+        return self._entries[-1][0] if self._entries else None
+
+    def clear(self):
+        self._entries.clear()
+
+def make_index(spec):
+    # Tuples are hash indexes for equality, strings are sorted for ranges.
+    return SortedIndex(spec) if isinstance(spec, str) else HashIndex(spec)
+
+def index_fields(spec) -> tuple:
+    return (spec,) if isinstance(spec, str) else tuple(spec)
+
+class IndexSet:
+    """An in-memory mirror of a table's documents along with hash indexes over
+    them. Every lookup that is covered by an index is a dictionary hit."""
+    def __init__(self, specs=()):
+        self.documents: Dict[int, dict] = {}
+        self.indexes = [make_index(spec) for spec in specs]
+        self.sorted = {index.field: index for index in self.indexes
+            if isinstance(index, SortedIndex)}
+
+        # Built on demand for paging, only adding or dropping ids resets it.
+        self._sorted_ids = None
+
+    def load(self, items: Iterable[Tuple[int, dict]]):
+        self.clear()
+        for doc_id, document in items:
+            self.put(doc_id, document)
+
+    def put(self, doc_id, document):
+        previous = self.documents.get(doc_id)
+        if previous is None:
+            self._sorted_ids = None
+        else:
+            for index in self.indexes:
+                index.discard(doc_id, previous)
+
+        self.documents[doc_id] = document
+        for index in self.indexes:
+            index.add(doc_id, document)
+
+    def drop(self, doc_id):
+        document = self.documents.pop(doc_id, None)
+        if document is not None:
+            self._sorted_ids = None
+            for index in self.indexes:
+                index.discard(doc_id, document)
+
+    def clear(self):
+        self.documents.clear()
+        self._sorted_ids = None
+        for index in self.indexes:
+            index.clear()
+
+    def find_range(self, field, low=None, high=None, limit=None) \
+        -> List[Tuple[int, dict]]:
+        """Finds documents whose `field` is between `low` and `high`
+        (inclusive) in order of that field. Needs a sorted index on `field`."""
+        doc_ids = self.sorted[field].range(low, high, limit)
+        return [(doc_id, self.documents[doc_id]) for doc_id in doc_ids]
+
+    def range_ids(self, field, low=None, high=None) -> List[int]:
+        return self.sorted[field].range(low, high)
+
+    def last_value(self, field):
+        return self.sorted[field].last_value()
+
+    def page(self, after, limit) -> List[Tuple[int, dict]]:
+        """Gets up to `limit` documents whose ids come after `after`, in order
+        of id. Useful for walking a table without copying all of it."""
+        if self._sorted_ids is None:
+            self._sorted_ids = sorted(self.documents)
+
+        start = bisect.bisect_right(self._sorted_ids, after)
+        return [(doc_id, self.documents[doc_id])
+            for doc_id in self._sorted_ids[start:start + limit]]
+
+    def best_index(self, fields) -> Optional[HashIndex]:
+        # The index that leaves the fewest documents to check wins.
+        usable = [index for index in self.indexes
+            if isinstance(index, HashIndex)
+            and set(index.fields) <= set(fields)]
+        return min(usable, default=None, key=lambda index: len(index.lookup(
+            tuple(fields[f] for f in index.fields))))
+
+    def find(self, fields: dict) -> List[Tuple[int, dict]]:
+        """Finds every document whose fields equal `fields`.
+
+        :param fields: Field names (see `resolve`) and their values.
+        :type fields: dict
+        :return: Pairs of document ids and documents.
+        :rtype: List[Tuple[int, dict]]
+        """
+        index = self.best_index(fields)
+        if index is None:
+            if fields:
+                logger.debug('No index covers %s, scanning', list(fields))
+            doc_ids = self.documents.keys()
+            remaining = fields
+        else:
+            doc_ids = index.lookup(tuple(fields[f] for f in index.fields))
+            remaining = {k: v for k, v in fields.items()
+                if k not in index.fields}
+
+        results = []
+        for doc_id in sorted(doc_ids):
+            document = self.documents[doc_id]
+            if all(resolve(document, k) == v for k, v in remaining.items()):
+                results.append((doc_id, document))
+        return results
+
+class Lookups:
+    """Equality lookups that every storage engine's tables share. Subclasses
+    provide `find`, `find_ids`, `insert`, `update` and `remove`."""
+    def find_one(self, **fields) -> Optional[Document]:
+        results = self.find(**fields)
+        return results[0] if results else None
+
+    def upsert_by(self, document, **fields):
+        """Updates every document whose fields equal `fields` with the contents
+        of `document` or inserts it (along with `fields`) if there are none."""
+        doc_ids = self.find_ids(**fields)
+        if doc_ids:
+            self.update(document, doc_ids=doc_ids)
+        else:
+            self.insert({**fields, **document})
+
+    def remove_by(self, **fields):
+        doc_ids = self.find_ids(**fields)
+        if doc_ids:
+            self.remove(doc_ids=doc_ids)
+
+class IndexedTable(Lookups, Table):
+    """A TinyDB table that keeps an `IndexSet` in sync with every write so that
+    equality lookups never have to read and scan the whole file."""
+    def __init__(self, storage, name, indexes=(), **kwargs):
+        super().__init__(storage, name, **kwargs)
+        self._mirror = IndexSet(indexes)
+        self._loaded = False
+        self._touched = {}
+
+    @property
+    def mirror(self) -> IndexSet:
+        if not self._loaded:
+            logger.debug('Building indexes for %s', self.name)
+            self._mirror.load((doc.doc_id, dict(doc))
+                for doc in super().all())
+            self._loaded = True
+        return self._mirror
+
+    def _update_table(self, updater):
+        # Keep hold of the written table so that `_sync` can index the
+        # documents that were just changed without reading the file again.
+        def tracking_updater(table):
+            updater(table)
+            self._touched = table
+        super()._update_table(tracking_updater)
+
+    def _sync(self, doc_ids):
+        if self._loaded:
+            for doc_id in doc_ids:
+                document = self._touched.get(doc_id)
+                if document is None:
+                    self._mirror.drop(doc_id)
+                else:
+                    self._mirror.put(doc_id, copy.deepcopy(document))
+        self._touched = {}
+
+    def insert(self, document) -> int:
+        doc_id = super().insert(document)
+        self._sync([doc_id])
+        return doc_id
+
+    def insert_multiple(self, documents) -> List[int]:
+        doc_ids = super().insert_multiple(documents)
+        self._sync(doc_ids)
+        return doc_ids
+
+    def update(self, fields, cond=None, doc_ids=None) -> List[int]:
+        updated = super().update(fields, cond, doc_ids)
+        self._sync(updated)
+        return updated
+
+    def update_multiple(self, updates) -> List[int]:
+        updated = super().update_multiple(updates)
+        self._sync(updated)
+        return updated
+
+    def remove(self, cond=None, doc_ids=None) -> List[int]:
+        removed = super().remove(cond, doc_ids)
+        self._sync(removed)
+        return removed
+
+    def truncate(self):
+        super().truncate()
+        self._mirror.clear()
+        self._touched = {}
+
+    def reset(self):
+        # Rebuilds the indexes from storage the next time they are used.
+        self._mirror.clear()
+        self._loaded = False
+        self._touched = {}
+        self.clear_cache()
+
+    # ...
+
+    def get(self, cond=None, doc_id=None) -> Optional[Document]:
+        if cond is not None or doc_id is None:
+            return super().get(cond, doc_id)
+
+        document = self.mirror.documents.get(doc_id)
+        return None if document is None else \
+            Document(copy.deepcopy(document), doc_id)
+
+    def find(self, **fields) -> List[Document]:
+        """Finds every document whose fields equal `fields`.
+
+        Example:
+
+            `table.find(original_cid=0, original_mid=0)`
+
+        :return: Copies of the matching documents.
+        :rtype: List[Document]
+        """
+        return [Document(copy.deepcopy(document), doc_id)
+            for doc_id, document in self.mirror.find(fields)]
+
+    def find_ids(self, **fields) -> List[int]:
+        return [doc_id for doc_id, _ in self.mirror.find(fields)]
+
+    def page(self, after=0, limit=100) -> List[Document]:
+        return [Document(copy.deepcopy(document), doc_id)
+            for doc_id, document in self.mirror.page(after, limit)]
+
+    def find_range(self, field, low=None, high=None, limit=None) \
+        -> List[Document]:
+        return [Document(copy.deepcopy(document), doc_id) for doc_id, document
+            in self.mirror.find_range(field, low, high, limit)]
+
+    def range_ids(self, field, low=None, high=None) -> List[int]:
+        return self.mirror.range_ids(field, low, high)
+
+    def last_value(self, field):
+        return self.mirror.last_value(field)
+
+class BufferedStorage(Middleware):
+    """Passes reads and writes straight through to the storage, except during
+    a transaction when the data is kept in memory and only written once at
+    the end. Like TinyDB's `CachingMiddleware`, reads return the buffer
+    itself."""
+    def __init__(self, storage_cls=JSONStorage):
+        super().__init__(storage_cls)
+        self.depth = 0
+        self.buffer = None
+
+    def read(self):
+        if not self.depth:
+            return self.storage.read()
+
+        if self.buffer is None:
+            self.buffer = self.storage.read()
+        return self.buffer
+
+    def write(self, data):
+        if self.depth:
+            self.buffer = data
+        else:
+            self.storage.write(data)
+
+class IndexedTinyDB(TinyDB):
+    table_class = IndexedTable
+
+    def __init__(self, *args, indexes=None, **kwargs):
+        # Maps table names onto the fields that should be indexed.
+        self._indexes = indexes or {}
+        kwargs.setdefault('storage', BufferedStorage())
+        super().__init__(*args, **kwargs)
+
+    def table(self, name, **kwargs) -> IndexedTable:
+        kwargs.setdefault('indexes', self._indexes.get(name, ()))
+        return super().table(name, **kwargs)
+
+    @contextmanager
+    def transaction(self):
+        """Writes every change made inside it to the file at once, or none of
+        them if an exception is raised. Nested transactions are part of the
+        outermost one."""
+        storage = self.storage
+        storage.depth += 1
+        try:
+            yield
+            if storage.depth == 1 and storage.buffer is not None:
+                storage.storage.write(storage.buffer)
+        except BaseException:
+            if storage.depth == 1:
+                # The file was never touched, so the indexes are rebuilt.
+                for table in self._tables.values():
+                    table.reset()
+            raise
+        finally:
+            storage.depth -= 1
+            if not storage.depth:
+                storage.buffer = None
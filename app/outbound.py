@@ -0,0 +1,167 @@
+from ratelimit import TokenBucket, retry_after
+from typing import Dict
+from collections import Counter
+from enum import IntEnum
+from constants import *
+import itertools
+import discord
+import asyncio
+import logging
+import heapq
+
+logger = logging.getLogger(__name__)
+
+class Priority(IntEnum):
+    """Lower goes first when the bot has more to send than it has slots."""
+    # Follow-ups to a button that someone just pressed.
+    INTERACTION = 0
+    # Permission requests and anything else sent to the subject.
+    CONSENT     = 1
+    # Pending, approved and comment messages.
+    CURATION    = 2
+    BRIDGE      = 3
+    AIRDROP     = 4
+
+class Outbound:
+    """Every REST write that the bot makes on its own goes through here.
+    Callers first wait for their route's token bucket, so a busy channel only
+    holds up itself, and then for one of a few shared slots. Slots are handed
+    out in order of priority, so a burst of bridged messages cannot starve a
+    permission request.
+
+    Example:
+
+        `await outbound.send(channel, Priority.BRIDGE, embed=embed)`
+    """
+    def __init__(self, concurrency=OUTBOUND_CONCURRENCY):
+        self.concurrency = concurrency
+        # Routes are a kind of write and where it goes e.g., `('send', id)`.
+        self.buckets: Dict[tuple, TokenBucket] = {}
+        self._sweep_at = OUTBOUND_BUCKETS_KEPT
+        self.active = 0
+        self.sent = Counter()
+        self._routing = Counter()
+        self._waiters = []
+        self._counter = itertools.count()
+
+    def bucket(self, route) -> TokenBucket:
+        if route not in self.buckets:
+            if len(self.buckets) >= self._sweep_at:
+                self.sweep()
+            self.buckets[route] = TokenBucket(CHANNEL_SEND_RATE,
+                CHANNEL_SEND_PERIOD)
+        return self.buckets[route]
+
+    def sweep(self):
+        """Forgets the buckets of routes that have not been used lately e.g.,
+        one for every curator that was sent an airdrop."""
+        self.buckets = {route: bucket for route, bucket
+            in self.buckets.items() if not bucket.idle}
+        # Busy routes are kept, so do not sweep again until there are more.
+        self._sweep_at = max(OUTBOUND_BUCKETS_KEPT, 2 * len(self.buckets))
+
+    async def _acquire(self, priority):
+        # Slots are handed straight over on release, so no one is waiting
+        # whenever one is free.
+        if self.active < self.concurrency:
+            self.active += 1
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._counter), future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            # The slot may have been handed over just before cancelling.
+            if future.done() and not future.cancelled():
+                self._release()
+            raise
+
+    def _release(self):
+        # Hand the slot straight to whoever is next, skipping cancellations.
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                return future.set_result(None)
+        self.active -= 1
+
+    async def call(self, priority, route, function, *args, **kwargs):
+        """Calls the coroutine function `function` once `route` has a token
+        and a slot is free.
+
+        :param priority: How urgent the write is.
+        :type priority: Priority
+        :param route: Writes on the same route share a token bucket.
+        :type route: tuple
+        :return: Whatever `function` returns.
+        """
+        bucket = self.bucket(route)
+        self._routing[priority] += 1
+        try:
+            await bucket.acquire()
+        finally:
+            self._routing[priority] -= 1
+
+        await self._acquire(priority)
+        try:
+            result = await function(*args, **kwargs)
+        except discord.HTTPException as error:
+            if error.status == 429:
+                bucket.block(retry_after(error, CHANNEL_SEND_PERIOD))
+            raise
+        finally:
+            self._release()
+
+        self.sent[priority] += 1
+        return result
+
+    async def send(self, target, priority, **kwargs) -> discord.Message:
+        """Sends to a channel, or to a user in direct messages."""
+        kind = 'dm' if isinstance(target, discord.abc.User) else 'send'
+        return await self.call(priority, (kind, target.id), target.send,
+            **kwargs)
+
+    async def reply(self, message, priority, **kwargs) -> discord.Message:
+        return await self.call(priority, ('send', message.channel.id),
+            message.reply, **kwargs)
+
+    async def react(self, message, priority, emoji):
+        return await self.call(priority, ('react', message.channel.id),
+            message.add_reaction, emoji)
+
+    async def edit(self, message, priority, **kwargs):
+        return await self.call(priority, ('edit', message.channel.id),
+            message.edit, **kwargs)
+
+    async def delete(self, message, priority):
+        return await self.call(priority, ('delete', message.channel.id),
+            message.delete)
+
+    def depths(self) -> Dict[Priority, int]:
+        """Counts the writes that are waiting for a slot.
+
+        :return: Maps priorities onto the number of writes waiting.
+        :rtype: Dict[Priority, int]
+        """
+        depths = Counter(priority for priority, _, future in self._waiters
+            if not future.done())
+        return {Priority(priority): count for priority, count
+            in sorted(depths.items())}
+
+    def routing(self) -> Dict[Priority, int]:
+        """Counts the writes that are waiting for their route's bucket."""
+        return {Priority(priority): count for priority, count
+            in sorted(self._routing.items()) if count}
+
+    def stats(self) -> str:
+        def describe(counts):
+            return ', '.join(f'{priority.name.lower()} {count}'
+                for priority, count in counts.items()) or 'none'
+
+        return (f'{self.active}/{self.concurrency} active,'
+            f' queued: {describe(self.depths())},'
+            f' waiting on routes: {describe(self.routing())},'
+            f' {sum(self.sent.values())} sent')
+
+# Accessible in other modules.
+outbound = Outbound()
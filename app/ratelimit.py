@@ -0,0 +1,65 @@
+import asyncio
+import time
+
+class TokenBucket:
+    """Allows `rate` acquisitions every `period` seconds. Bursts of up to
+    `rate` go through immediately, after which callers wait their turn.
+
+    Example:
+
+        `await bucket.acquire()`
+    """
+    def __init__(self, rate, period):
+        self.rate = rate
+        self.period = period
+        self.tokens = float(rate)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.rate,
+            self.tokens + (now - self.updated) * self.rate / self.period)
+        self.updated = now
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                self._refill()
+                blocked = self.blocked_until - time.monotonic()
+                if blocked <= 0 and self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+
+                refill = (1 - self.tokens) * self.period / self.rate
+                await asyncio.sleep(max(blocked, refill))
+
+    @property
+    def idle(self) -> bool:
+        """Whether the bucket is full, unblocked and no one is waiting on it,
+        in which case a new bucket would behave the same."""
+        self._refill()
+        return self.tokens >= self.rate and not self._lock.locked() and \
+            self.blocked_until <= time.monotonic()
+
+    def block(self, seconds):
+        """Stops anyone acquiring for `seconds` i.e., after a 429."""
+        self.blocked_until = max(self.blocked_until,
+            time.monotonic() + seconds)
+        self.tokens = 0.0
+
+def retry_after(error, default) -> float:
+    """Gets how long Discord asked us to wait from a 429 response.
+
+    :param error: The exception that was raised.
+    :type error: discord.HTTPException
+    :param default: What to use if the header is missing.
+    :type default: float
+    :return: The number of seconds to wait.
+    :rtype: float
+    """
+    try:
+        return float(error.response.headers['Retry-After'])
+    except (AttributeError, KeyError, TypeError, ValueError):
+        return default
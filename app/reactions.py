@@ -0,0 +1,73 @@
+from typing import Iterable, List, NamedTuple, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+class ReactionHandler(NamedTuple):
+    callback: object
+    guild_ids: Optional[frozenset]
+    dms: bool
+
+    def wants(self, payload) -> bool:
+        if payload.guild_id is None:
+            return self.dms
+        return self.guild_ids is None or payload.guild_id in self.guild_ids
+
+class ReactionDispatcher:
+    """Routes raw reactions to the handlers that registered for their emoji.
+    Routing only looks at the payload, so reactions that nobody is interested
+    in never cause a REST call. Otherwise, the message is fetched once and
+    shared between every interested handler.
+
+    Example:
+
+        `bot.reactions.register('🔭', self.on_curate, dms=False)`
+    """
+    def __init__(self, bot):
+        self.bot = bot
+        self._handlers = {}
+
+    def register(self, emoji, callback, guild_ids: Iterable[int]=None,
+        dms=True):
+        """Calls `callback(message, payload)` whenever someone reacts with
+        `emoji`.
+
+        :param emoji: Any emoji.
+        :type emoji: str
+        :param callback: The coroutine function to call.
+        :param guild_ids: Only call for these guilds, defaults to all of them.
+        :type guild_ids: Iterable[int]
+        :param dms: Whether to call for direct messages, defaults to True.
+        :type dms: bool
+        """
+        guild_ids = None if guild_ids is None else frozenset(guild_ids)
+        handler = ReactionHandler(callback, guild_ids, dms)
+        self._handlers.setdefault(emoji, []).append(handler)
+
+    def unregister(self, callback):
+        for handlers in self._handlers.values():
+            handlers[:] = [h for h in handlers if h.callback != callback]
+
+    def interested(self, payload) -> List[ReactionHandler]:
+        handlers = self._handlers.get(str(payload.emoji), [])
+        return [handler for handler in handlers if handler.wants(payload)]
+
+    async def dispatch(self, payload):
+        # Do not proceed if it was our own reaction.
+        if payload.user_id == self.bot.user.id:
+            return
+
+        handlers = self.interested(payload)
+        if not handlers:
+            return
+
+        message = await self.bot.fetch_message(payload.channel_id,
+            payload.message_id)
+
+        for handler in handlers:
+            try:
+                await handler.callback(message, payload)
+            except Exception:
+                logger.exception('Reaction handler %s failed on %s/%s',
+                    handler.callback.__qualname__, payload.channel_id,
+                    payload.message_id)
@@ -0,0 +1,648 @@
+from tinydb.table import Document
+from indexes import IndexSet, IndexedTinyDB, Lookups, index_fields, resolve
+from typing import List, Optional
+from contextlib import contextmanager
+from constants import *
+import threading
+import logging
+import atexit
+import sqlite3
+import shutil
+import copy
+import json
+import os
+
+logger = logging.getLogger(__name__)
+
+class SQLiteTable(Lookups):
+    """A table stored in SQLite which has the same interface as an
+    `indexes.IndexedTable`. Every document is kept as JSON and each indexed
+    field is copied into its own column so that lookups use real indexes."""
+    def __init__(self, storage, name, indexes=()):
+        self.storage = storage
+        self.connection = storage.connection
+        self.name = name
+        self.columns = sorted({field for spec in indexes
+            for field in index_fields(spec)})
+        self._create(indexes)
+
+    def _create(self, indexes):
+        columns = ''.join(f', "{column}"' for column in self.columns)
+        with self.storage.atomic():
+            self.connection.execute(f'CREATE TABLE IF NOT EXISTS "{self.name}"'
+                f' (doc_id INTEGER PRIMARY KEY, document TEXT NOT NULL'
+                f'{columns})')
+
+            # Indexes added since the table was made need their columns
+            # filled in from the stored documents.
+            existing = {row[1] for row in self.connection.execute(
+                f'PRAGMA table_info("{self.name}")')}
+            missing = [c for c in self.columns if c not in existing]
+            for column in missing:
+                self.connection.execute(f'ALTER TABLE "{self.name}"'
+                    f' ADD COLUMN "{column}"')
+            if missing:
+                self._backfill()
+
+            for spec in map(index_fields, indexes):
+                index_name = '_'.join([self.name, *spec])
+                fields = ', '.join(f'"{field}"' for field in spec)
+                self.connection.execute(f'CREATE INDEX IF NOT EXISTS'
+                    f' "{index_name}" ON "{self.name}" ({fields})')
+
+    def _backfill(self):
+        cursor = self.connection.execute(
+            f'SELECT doc_id, document FROM "{self.name}"')
+        self._write([self._row(doc_id, json.loads(text))
+            for doc_id, text in cursor.fetchall()])
+
+    def _row(self, doc_id, document) -> tuple:
+        return (doc_id, json.dumps(document),
+            *(resolve(document, column) for column in self.columns))
+
+    def _write(self, rows):
+        placeholders = ', '.join('?' * (2 + len(self.columns)))
+        columns = ''.join(f', "{column}"' for column in self.columns)
+        self.connection.executemany(f'INSERT OR REPLACE INTO "{self.name}"'
+            f' (doc_id, document{columns}) VALUES ({placeholders})', rows)
+
+    def _select(self, fields, columns='doc_id, document') -> list:
+        # Fields with a column are filtered by SQLite, the rest in Python.
+        pushed = {k: v for k, v in fields.items() if k in self.columns}
+        where = ' AND '.join(f'"{k}" IS ?' for k in pushed) or '1'
+        cursor = self.connection.execute(f'SELECT {columns} FROM'
+            f' "{self.name}" WHERE {where} ORDER BY doc_id',
+            tuple(pushed.values()))
+
+        if len(pushed) == len(fields) and columns == 'doc_id':
+            return [doc_id for doc_id, in cursor]
+
+        results = []
+        for doc_id, text in cursor:
+            document = json.loads(text)
+            if all(resolve(document, k) == v for k, v in fields.items()
+                if k not in pushed):
+                results.append(Document(document, doc_id))
+        return results
+
+    # ...
+
+    def insert(self, document) -> int:
+        return self.insert_multiple([document])[0]
+
+    def insert_multiple(self, documents) -> List[int]:
+        doc_ids = []
+        with self.storage.atomic():
+            next_id = self._next_id()
+            rows = []
+            for document in documents:
+                if isinstance(document, Document):
+                    doc_id = document.doc_id
+                else:
+                    doc_id, next_id = next_id, next_id + 1
+                doc_ids.append(doc_id)
+                rows.append(self._row(doc_id, dict(document)))
+            self._write(rows)
+        return doc_ids
+
+    def _next_id(self) -> int:
+        cursor = self.connection.execute(
+            f'SELECT COALESCE(MAX(doc_id), 0) + 1 FROM "{self.name}"')
+        return cursor.fetchone()[0]
+
+    def update(self, fields, cond=None, doc_ids=None) -> List[int]:
+        if cond is not None:
+            raise NotImplementedError('SQLite tables do not support queries')
+
+        updated = []
+        with self.storage.atomic():
+            rows = []
+            for doc_id in doc_ids or []:
+                document = self.get(doc_id=doc_id)
+                if document is None:
+                    raise KeyError(doc_id)
+                document.update(fields)
+                rows.append(self._row(doc_id, dict(document)))
+                updated.append(doc_id)
+            self._write(rows)
+        return updated
+
+    def upsert(self, document, cond=None) -> List[int]:
+        if not isinstance(document, Document):
+            raise NotImplementedError('SQLite tables do not support queries')
+
+        if self.get(doc_id=document.doc_id) is None:
+            return [self.insert(document)]
+        return self.update(document, doc_ids=[document.doc_id])
+
+    def remove(self, cond=None, doc_ids=None) -> List[int]:
+        if cond is not None:
+            raise NotImplementedError('SQLite tables do not support queries')
+
+        doc_ids = list(doc_ids or [])
+        with self.storage.atomic():
+            self.connection.executemany(f'DELETE FROM "{self.name}"'
+                ' WHERE doc_id = ?', [(doc_id,) for doc_id in doc_ids])
+        return doc_ids
+
+    def truncate(self):
+        with self.storage.atomic():
+            self.connection.execute(f'DELETE FROM "{self.name}"')
+
+    def get(self, cond=None, doc_id=None) -> Optional[Document]:
+        if cond is not None:
+            raise NotImplementedError('SQLite tables do not support queries')
+
+        cursor = self.connection.execute(f'SELECT document FROM'
+            f' "{self.name}" WHERE doc_id = ?', (doc_id,))
+        row = cursor.fetchone()
+        return None if row is None else Document(json.loads(row[0]), doc_id)
+
+    def all(self) -> List[Document]:
+        return self._select({})
+
+    def __iter__(self):
+        return iter(self.all())
+
+    def __len__(self) -> int:
+        cursor = self.connection.execute(f'SELECT COUNT(*) FROM "{self.name}"')
+        return cursor.fetchone()[0]
+
+    # ...
+
+    def find(self, **fields) -> List[Document]:
+        return self._select(fields)
+
+    def find_ids(self, **fields) -> List[int]:
+        # Avoids reading documents when every field has a column.
+        if all(field in self.columns for field in fields):
+            return self._select(fields, columns='doc_id')
+        return [result.doc_id for result in self._select(fields)]
+
+    def page(self, after=0, limit=100) -> List[Document]:
+        cursor = self.connection.execute(f'SELECT doc_id, document FROM'
+            f' "{self.name}" WHERE doc_id > ? ORDER BY doc_id LIMIT ?',
+            (after, limit))
+        return [Document(json.loads(text), doc_id) for doc_id, text in cursor]
+
+    def find_range(self, field, low=None, high=None, limit=None,
+        columns='doc_id, document') -> List[Document]:
+        where = [f'"{field}" IS NOT NULL']
+        parameters = []
+        if low is not None:
+            where.append(f'"{field}" >= ?')
+            parameters.append(low)
+        if high is not None:
+            where.append(f'"{field}" <= ?')
+            parameters.append(high)
+
+        cursor = self.connection.execute(f'SELECT {columns} FROM'
+            f' "{self.name}" WHERE {" AND ".join(where)}'
+            f' ORDER BY "{field}", doc_id LIMIT ?',
+            (*parameters, -1 if limit is None else limit))
+
+        if columns == 'doc_id':
+            return [doc_id for doc_id, in cursor]
+        return [Document(json.loads(text), doc_id) for doc_id, text in cursor]
+
+    def range_ids(self, field, low=None, high=None) -> List[int]:
+        return self.find_range(field, low, high, columns='doc_id')
+
+    def last_value(self, field):
+        cursor = self.connection.execute(
+            f'SELECT MAX("{field}") FROM "{self.name}"')
+        return cursor.fetchone()[0]
+
+class SQLiteStorage:
+    """Keeps every table in a single SQLite database in WAL mode, so that a
+    write only touches the rows that changed."""
+    def __init__(self, filename, indexes=None):
+        # The connection is shared with the database thread.
+        self.connection = sqlite3.connect(filename, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self._indexes = indexes or {}
+        self._tables = {}
+        self._depth = 0
+        # Tables first used in the current transaction.
+        self._created = []
+
+        # Made up front, so that a rolled back transaction cannot drop them.
+        for name in self._indexes:
+            self.table(name)
+
+    @contextmanager
+    def atomic(self):
+        # Inside a transaction, changes are committed along with the rest.
+        if self._depth:
+            yield
+        else:
+            with self.connection:
+                yield
+
+    @contextmanager
+    def transaction(self):
+        """Commits every change made inside it at once, or none of them if an
+        exception is raised. Nested transactions are part of the outermost
+        one."""
+        self._depth += 1
+        try:
+            yield
+            if self._depth == 1:
+                self.connection.commit()
+        except BaseException:
+            if self._depth == 1:
+                self.connection.rollback()
+                # Their `CREATE TABLE` was rolled back too.
+                for name in self._created:
+                    self._tables.pop(name, None)
+            raise
+        finally:
+            self._depth -= 1
+            if not self._depth:
+                self._created.clear()
+
+    def table(self, name) -> SQLiteTable:
+        if name not in self._tables:
+            self._tables[name] = SQLiteTable(self, name,
+                self._indexes.get(name, ()))
+            if self._depth:
+                self._created.append(name)
+        return self._tables[name]
+
+    def tables(self) -> set:
+        cursor = self.connection.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table'")
+        return {name for name, in cursor}
+
+    def close(self):
+        self.connection.close()
+
+class JournalTable(Lookups):
+    """A table that is held entirely in memory. Changes are written to the
+    journal of its `JournalStorage` before they are applied."""
+    def __init__(self, storage, name, indexes=()):
+        self.storage = storage
+        self.name = name
+        self.mirror = IndexSet(indexes)
+        self._next_id = 1
+
+    def apply(self, record):
+        if record['op'] == 'put':
+            self.mirror.put(record['id'], record['doc'])
+            self._next_id = max(self._next_id, record['id'] + 1)
+        elif record['op'] == 'del':
+            self.mirror.drop(record['id'])
+        elif record['op'] == 'truncate':
+            self.mirror.clear()
+        elif record['op'] == 'restore':
+            self.mirror.clear()
+            for doc_id, document in record['docs'].items():
+                self.mirror.put(doc_id, document)
+
+    def undo(self, record) -> dict:
+        """Makes the record that reverses `record` if it were applied now."""
+        if record['op'] == 'truncate':
+            return {'op': 'restore', 'docs': dict(self.mirror.documents)}
+
+        document = self.mirror.documents.get(record['id'])
+        if document is None:
+            return {'op': 'del', 'id': record['id']}
+        return {'op': 'put', 'id': record['id'], 'doc': document}
+
+    def _commit(self, records):
+        self.storage.commit(self, records)
+
+    def _put_record(self, doc_id, document) -> dict:
+        # Documents are never changed in place once they are in the mirror,
+        # which lets compaction snapshot them without copying.
+        return {'table': self.name, 'op': 'put', 'id': doc_id,
+                'doc': copy.deepcopy(dict(document))}
+
+    # ...
+
+    def insert(self, document) -> int:
+        return self.insert_multiple([document])[0]
+
+    def insert_multiple(self, documents) -> List[int]:
+        doc_ids = []
+        records = []
+        next_id = self._next_id
+        for document in documents:
+            if isinstance(document, Document):
+                doc_id = document.doc_id
+            else:
+                doc_id, next_id = next_id, next_id + 1
+            doc_ids.append(doc_id)
+            records.append(self._put_record(doc_id, document))
+        self._commit(records)
+        return doc_ids
+
+    def update(self, fields, cond=None, doc_ids=None) -> List[int]:
+        if cond is not None:
+            raise NotImplementedError('Journal tables do not support queries')
+
+        records = []
+        for doc_id in doc_ids or []:
+            document = self.mirror.documents.get(doc_id)
+            if document is None:
+                raise KeyError(doc_id)
+            records.append(self._put_record(doc_id, {**document, **fields}))
+        self._commit(records)
+        return [record['id'] for record in records]
+
+    def upsert(self, document, cond=None) -> List[int]:
+        if not isinstance(document, Document):
+            raise NotImplementedError('Journal tables do not support queries')
+
+        if document.doc_id not in self.mirror.documents:
+            return [self.insert(document)]
+        return self.update(document, doc_ids=[document.doc_id])
+
+    def remove(self, cond=None, doc_ids=None) -> List[int]:
+        if cond is not None:
+            raise NotImplementedError('Journal tables do not support queries')
+
+        doc_ids = [doc_id for doc_id in doc_ids or []
+            if doc_id in self.mirror.documents]
+        self._commit([{'table': self.name, 'op': 'del', 'id': doc_id}
+            for doc_id in doc_ids])
+        return doc_ids
+
+    def truncate(self):
+        self._commit([{'table': self.name, 'op': 'truncate'}])
+
+    def get(self, cond=None, doc_id=None) -> Optional[Document]:
+        if cond is not None:
+            raise NotImplementedError('Journal tables do not support queries')
+
+        document = self.mirror.documents.get(doc_id)
+        return None if document is None else \
+            Document(copy.deepcopy(document), doc_id)
+
+    def all(self) -> List[Document]:
+        return self.find()
+
+    def __iter__(self):
+        return iter(self.all())
+
+    def __len__(self) -> int:
+        return len(self.mirror.documents)
+
+    # ...
+
+    def find(self, **fields) -> List[Document]:
+        return [Document(copy.deepcopy(document), doc_id)
+            for doc_id, document in self.mirror.find(fields)]
+
+    def find_ids(self, **fields) -> List[int]:
+        return [doc_id for doc_id, _ in self.mirror.find(fields)]
+
+    def page(self, after=0, limit=100) -> List[Document]:
+        return [Document(copy.deepcopy(document), doc_id)
+            for doc_id, document in self.mirror.page(after, limit)]
+
+    def find_range(self, field, low=None, high=None, limit=None) \
+        -> List[Document]:
+        return [Document(copy.deepcopy(document), doc_id) for doc_id, document
+            in self.mirror.find_range(field, low, high, limit)]
+
+    def range_ids(self, field, low=None, high=None) -> List[int]:
+        return self.mirror.range_ids(field, low, high)
+
+    def last_value(self, field):
+        return self.mirror.last_value(field)
+
+class JournalStorage:
+    """Keeps every table in memory and appends each change to a JSONL journal,
+    so that a write costs as much as the record it writes. The journal is
+    fsynced in batches and is periodically compacted into a snapshot in the
+    background. The snapshot has the same layout as TinyDB's `data.json`."""
+    def __init__(self, filename, indexes=None,
+        fsync_interval=JOURNAL_FSYNC_INTERVAL,
+        compact_interval=JOURNAL_COMPACT_INTERVAL):
+        self.filename = filename
+        self.journal_filename = filename + '.journal'
+        self.rotated_filename = filename + '.journal.1'
+        self._indexes = indexes or {}
+        self._tables = {}
+
+        # Guards the journal file, `_compacting` allows one compaction only.
+        self._lock = threading.RLock()
+        self._compacting = threading.Lock()
+        self._closed = threading.Event()
+        self._dirty = False
+        self._pending = 0
+
+        # Records and how to undo them while there is a transaction.
+        self._batch = None
+        self._undo = None
+
+        self._journal = open(self.journal_filename, 'a', encoding='utf-8')
+        self._load()
+
+        # Records that have not been synced yet would be lost at exit.
+        atexit.register(self.close)
+
+        for target, interval in [(self._sync_loop, fsync_interval),
+                                 (self._compact_loop, compact_interval)]:
+            threading.Thread(target=target, args=(interval,),
+                name=f'journal-{target.__name__}', daemon=True).start()
+
+    def table(self, name) -> JournalTable:
+        with self._lock:
+            if name not in self._tables:
+                self._tables[name] = JournalTable(self, name,
+                    self._indexes.get(name, ()))
+            return self._tables[name]
+
+    def tables(self) -> set:
+        return set(self._tables)
+
+    def _load(self):
+        if os.path.exists(self.filename):
+            with open(self.filename, encoding='utf-8') as file:
+                text = file.read()
+
+            for name, documents in (json.loads(text) if text.strip() else
+                {}).items():
+                table = self.table(name)
+                for doc_id, document in documents.items():
+                    table.apply({'op': 'put', 'id': int(doc_id),
+                        'doc': document})
+
+        replayed = 0
+        for filename in [self.rotated_filename, self.journal_filename]:
+            if os.path.exists(filename):
+                replayed += self._replay(filename)
+
+        logger.info('Loaded %s with %s journal records', self.filename,
+            replayed)
+
+        # Start from a clean snapshot, which also drops any torn records. This
+        # happens even if nothing was replayed, since a torn record left in
+        # the journal would swallow the next one appended after it.
+        if any(os.path.exists(filename) and os.path.getsize(filename)
+            for filename in [self.rotated_filename, self.journal_filename]):
+            self.compact()
+
+    def _replay(self, filename) -> int:
+        replayed = 0
+        with open(filename, encoding='utf-8') as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    logger.warning('Ignoring torn record in %s', filename)
+                    continue
+                for record in record.get('records', [record]):
+                    self.table(record['table']).apply(record)
+                replayed += 1
+        return replayed
+
+    def commit(self, table, records):
+        """Journals `records` and then applies them to `table`. During a
+        transaction, they are applied straight away but only journaled when
+        it ends."""
+        # Compaction must not snapshot anything that is not journaled yet.
+        with self._lock:
+            if self._batch is None:
+                self.append(records)
+            else:
+                self._batch.extend(records)
+
+            for record in records:
+                if self._undo is not None:
+                    self._undo.append((table, table.undo(record)))
+                table.apply(record)
+
+    @contextmanager
+    def transaction(self):
+        """Journals every change made inside it as one record, or undoes them
+        all if an exception is raised. A torn record is ignored when the
+        journal is replayed, so a crash leaves all or none of them. Nested
+        transactions are part of the outermost one."""
+        with self._lock:
+            if self._batch is not None:
+                yield
+                return
+
+            self._batch, self._undo = [], []
+            try:
+                yield
+                if self._batch:
+                    self.append([{'op': 'batch', 'records': self._batch}])
+            except BaseException:
+                for table, record in reversed(self._undo):
+                    table.apply(record)
+                raise
+            finally:
+                self._batch = self._undo = None
+
+    def append(self, records):
+        with self._lock:
+            for record in records:
+                self._journal.write(json.dumps(record) + '\n')
+            self._dirty = True
+            self._pending += len(records)
+
+    def sync(self):
+        """Makes every record appended so far durable."""
+        with self._lock:
+            if self._dirty:
+                self._journal.flush()
+                os.fsync(self._journal.fileno())
+                self._dirty = False
+
+    def _sync_loop(self, interval):
+        while not self._closed.wait(interval):
+            self.sync()
+
+    def _compact_loop(self, interval):
+        while not self._closed.wait(interval):
+            if self._pending:
+                try:
+                    self.compact()
+                except Exception:
+                    logger.exception('Failed to compact %s', self.filename)
+
+    def compact(self):
+        """Writes every table to the snapshot and discards the journal. Only the
+        journal rotation happens while writers are blocked."""
+        with self._compacting:
+            with self._lock:
+                self.sync()
+                self._journal.close()
+                self._rotate()
+                self._journal = open(self.journal_filename, 'a',
+                    encoding='utf-8')
+                self._pending = 0
+
+                snapshot = {name: dict(table.mirror.documents)
+                    for name, table in self._tables.items()}
+
+            temporary = self.filename + '.tmp'
+            with open(temporary, 'w', encoding='utf-8') as file:
+                json.dump(snapshot, file)
+                file.flush()
+                os.fsync(file.fileno())
+
+            os.replace(temporary, self.filename)
+            os.remove(self.rotated_filename)
+            logger.debug('Compacted %s', self.filename)
+
+    def _rotate(self):
+        if not os.path.exists(self.rotated_filename):
+            os.replace(self.journal_filename, self.rotated_filename)
+            return
+
+        # The last compaction failed, so keep its records as well.
+        with open(self.rotated_filename, 'a', encoding='utf-8') as target, \
+             open(self.journal_filename, encoding='utf-8') as source:
+            shutil.copyfileobj(source, target)
+        os.remove(self.journal_filename)
+
+    def close(self):
+        if not self._closed.is_set():
+            self._closed.set()
+            self.sync()
+            self._journal.close()
+
+ENGINES = {
+    'tinydb': lambda filename, indexes:
+        IndexedTinyDB(filename, indexes=indexes, indent=4),
+    'sqlite': SQLiteStorage,
+    'journal': JournalStorage
+}
+
+def open_storage(engine, filename, indexes=None):
+    """Opens the storage backend called `engine`.
+
+    :param engine: The name of the engine i.e., 'tinydb', 'sqlite' or
+        'journal'.
+    :type engine: str
+    :param filename: Where the engine should keep its data.
+    :type filename: str
+    :param indexes: Maps table names onto the fields to index.
+    :type indexes: dict
+    :return: Something with a `table` method that returns tables.
+    """
+    if engine not in ENGINES:
+        raise ValueError(f'Unknown database engine {engine!r}')
+
+    logger.info('Using %s storage engine', engine)
+    return ENGINES[engine](filename, indexes or {})
+
+def copy_storage(source, destination):
+    """Copies every table in `source` into `destination`. Useful when moving an
+    existing `data.json` over to SQLite, which keeps the document ids.
+
+    Example:
+
+        `copy_storage(open_storage('tinydb', 'data.json', INDEXES),
+                      open_storage('sqlite', 'data.sqlite3', INDEXES))`
+    """
+    for name in source.tables():
+        documents = list(source.table(name))
+        destination.table(name).insert_multiple(documents)
+        logger.info('Copied %s documents from %s', len(documents), name)
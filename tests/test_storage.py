@@ -0,0 +1,58 @@
+from pathlib import Path
+import tempfile
+import unittest
+import sys
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'app'))
+
+from storage import JournalStorage, SQLiteStorage
+
+class JournalRecoveryTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.filename = str(Path(self.directory.name) / 'data.json')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def open(self) -> JournalStorage:
+        storage = JournalStorage(self.filename)
+        self.addCleanup(storage.close)
+        return storage
+
+    def test_torn_tail_does_not_swallow_next_record(self):
+        # A crash in the middle of an append leaves only part of a record.
+        with open(self.filename + '.journal', 'w', encoding='utf-8') as file:
+            file.write('{"table": "x", "op": "put", "id": 1, "doc": {"a"')
+
+        storage = self.open()
+        storage.table('x').insert({'a': 5})
+        storage.close()
+
+        documents = self.open().table('x').all()
+        self.assertEqual([dict(document) for document in documents],
+            [{'a': 5}])
+
+class SQLiteTransactionTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.storage = SQLiteStorage(str(Path(self.directory.name) / 'data'),
+            {'indexed': [('a',)]})
+
+    def tearDown(self):
+        self.storage.close()
+        self.directory.cleanup()
+
+    def test_tables_first_used_in_rolled_back_transaction(self):
+        for name in ['indexed', 'unindexed']:
+            with self.assertRaises(RuntimeError):
+                with self.storage.transaction():
+                    self.storage.table(name).insert({'a': 1})
+                    raise RuntimeError()
+
+            self.storage.table(name).insert({'a': 2})
+            self.assertEqual([document['a'] for document in
+                self.storage.table(name).all()], [2])
+
+if __name__ == '__main__':
+    unittest.main()